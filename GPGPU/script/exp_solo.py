@@ -1,4 +1,5 @@
 import os
+import sys
 import subprocess
 import time
 import signal
@@ -8,6 +9,9 @@ import pandas as pd
 from pathlib import Path
 import psutil
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "power_util"))
+from collector_client import collector_request, wait_for_collector
+
 SYSFS = Path("/sys/devices/system/cpu")
 
 def expand_cpu_list(expr: str) -> list[int]:
@@ -32,16 +36,14 @@ def online_cpus() -> list[int]:
 
 sib0 = thread_siblings(0)   # GPU helper core (excluded)
 sib1 = thread_siblings(1)   # reserved for CPU power
-sib2 = thread_siblings(2)   # we will split its two threads
+sib2 = thread_siblings(2)   # first thread hosts the CPU counter collector
 
-# pick specific threads from core 2
-if len(sib2) < 2:
-    raise RuntimeError("Core 2 does not have two logical siblings (no SMT?)")
-t_mem = sib2[0]   # first logical thread of core 2
-t_ips = sib2[1]   # second logical thread of core 2
+# one perf session covers IPS, LLC misses and memory bandwidth, so only the
+# first logical thread of core 2 is reserved; its sibling runs the benchmark
+t_counters = sib2[0]
 
-# allowed CPUs = all online minus sib0, sib1, sib2
-allowed = sorted(set(online_cpus()) - set(sib0) - set(sib1) - set(sib2))
+# allowed CPUs = all online minus sib0, sib1 and the counter thread
+allowed = sorted(set(online_cpus()) - set(sib0) - set(sib1) - {t_counters})
 
 allowed_str = ",".join(map(str, allowed))
 sib1_str = ",".join(map(str, sib1))
@@ -61,6 +63,13 @@ read_cpu_ips = "./power_util/read_cpu_ips.py"
 # read_mem = "./power_util/read_mem.py"
 read_mem = "./power_util/read_cpu_metrics.py"
 read_ips = "./power_util/read_cpu_metrics2.py"
+read_proc_tree = "./power_util/read_proc_tree.py"
+read_cpu_counters = "./power_util/read_cpu_counters.py"
+collector = "./power_util/collector.py"
+
+# one long-lived collector hosts every sensor and is armed per run over its
+# control socket; 0 falls back to one monitor process per sensor and run
+use_collector = 1
 
 # scritps for running various benchmarks
 run_altis = "./run_benchmark/run_altis.py"
@@ -105,19 +114,13 @@ gpu_caps = [250]
 cpu_caps = [540]
 
 
-MG = "g1"
-
-
-# def ensure_resctrl(mg="g1"):
-#     subprocess.run("sudo mount -t resctrl resctrl /sys/fs/resctrl || true", shell=True, check=False)
-#     subprocess.run(f"sudo mkdir -p /sys/fs/resctrl/mon_groups/{mg}", shell=True, check=False)
-
-# ensure_resctrl()
+# resctrl MBM: `read_cpu_metrics.py --backend resctrl` mounts resctrl, creates a
+# per-run monitoring group, attaches the benchmark tree and removes the group itself
 
 
 def run_benchmark(benchmark_script_dir,benchmark, suite, test, size,cap_type):
 
-    def cap_exp(cpu_cap, gpu_cap, output_cpu_power, output_gpu_metrics, output_mem, output_ips):
+    def cap_exp(cpu_cap, gpu_cap, output_cpu_power, output_gpu_metrics, output_cpu_metrics, output_proc_tree):
         
         
         # # Set CPU and GPU power caps and wait for them to take effect
@@ -145,16 +148,25 @@ def run_benchmark(benchmark_script_dir,benchmark, suite, test, size,cap_type):
         benchmark_process = subprocess.Popen(f"taskset -c {allowed_str} {run_benchmark_command}", shell=True)
         benchmark_pid = benchmark_process.pid
 
+        if use_collector:
+            outputs = {"cpu_power": output_cpu_power, "proc_tree": output_proc_tree,
+                       "cpu_metrics": output_cpu_metrics}
+            if suite != "npb":
+                outputs["gpu_metrics"] = output_gpu_metrics
+            reply = collector_request({"cmd": "arm", "pid": benchmark_pid, "outputs": outputs})
+            if not reply["ok"]:
+                print(f"collector: arm failed: {reply['error']}")
+            benchmark_process.wait()
+            # the run disarms itself on benchmark exit; this waits for the final samples
+            print(f"collector: {collector_request({'cmd': 'wait'})}")
+            return
+
         # benchmark_process = subprocess.Popen(
         #     f"taskset -c {allowed_str} {run_benchmark_command}",
         #     shell=True
         # )
         # benchmark_pid = benchmark_process.pid  # this is the actual app PID
         
-        # 2. Attach the PID to resctrl monitor group
-        # attach_cmd = f"echo {benchmark_pid} | sudo tee /sys/fs/resctrl/mon_groups/{MG}/tasks"
-        # subprocess.run(attach_cmd, shell=True, check=True)
-
         # monitor cpu power
         # monitor_command_cpu = f"echo 9900 | sudo -S {python_executable} {read_cpu_power}  --output_csv {output_cpu_power} --pid {benchmark_pid} "
         monitor_command_cpu = (
@@ -164,6 +176,14 @@ def run_benchmark(benchmark_script_dir,benchmark, suite, test, size,cap_type):
         )
         monitor_process1 = subprocess.Popen(monitor_command_cpu, shell=True, stdin=subprocess.PIPE, text=True)
 
+        # follow the real workload (run_X.py -> bench.sh -> binary) below the shell PID
+        monitor_command_proc_tree = (
+            f"echo 9900 | sudo -S taskset -c {sib1_str} "
+            f"{python_executable} {read_proc_tree} "
+            f"--output_csv {output_proc_tree} --pid {benchmark_pid}"
+        )
+        monitor_process5 = subprocess.Popen(monitor_command_proc_tree, shell=True, stdin=subprocess.PIPE, text=True)
+
          # read cpu_metrics
         # monitor_command_cpu_metrics = f"echo 9900 | sudo -S {python_executable} {read_cpu_metrics}  --output_csv {output_cpu_metrics} --pid {benchmark_pid} "
 #         monitor_command_cpu_metrics = (
@@ -177,19 +197,13 @@ def run_benchmark(benchmark_script_dir,benchmark, suite, test, size,cap_type):
 #     f"--output_csv {output_mem} --pid {benchmark_pid}"
 # )
 #         monitor_process2 = subprocess.Popen(monitor_command_mem, shell=True, stdin=subprocess.PIPE, text=True)
-        monitor_command_mem = (
-            f"echo 9900 | sudo -S taskset -c {t_mem} "
-            f"{python_executable} {read_mem} "
-            f"--output_csv {output_mem} --pid {benchmark_pid}"
-        )
-        monitor_process2 = subprocess.Popen(monitor_command_mem, shell=True, stdin=subprocess.PIPE, text=True)
-    
-        monitor_command_ips = (
-            f"echo 9900 | sudo -S taskset -c {t_ips} "
-            f"{python_executable} {read_ips} "
-            f"--output_csv {output_ips} --pid {benchmark_pid}"
+        # IPS, LLC misses and IMC bandwidth from one perf session on a common interval
+        monitor_command_cpu_counters = (
+            f"echo 9900 | sudo -S taskset -c {t_counters} "
+            f"{python_executable} {read_cpu_counters} "
+            f"--output_csv {output_cpu_metrics} --pid {benchmark_pid}"
         )
-        monitor_process3 = subprocess.Popen(monitor_command_ips, shell=True, stdin=subprocess.PIPE, text=True)
+        monitor_process2 = subprocess.Popen(monitor_command_cpu_counters, shell=True, stdin=subprocess.PIPE, text=True)
 
         # # monitor GPU metrics
         if suite != "npb":
@@ -208,9 +222,9 @@ def run_benchmark(benchmark_script_dir,benchmark, suite, test, size,cap_type):
         for gpu_cap in gpu_caps:
             output_cpu_power = f"../data/{suite}_solo/{benchmark}/cpu_power.csv"
             output_gpu_metrics = f"/home/cc/power/GPGPU/data/{suite}_solo/{benchmark}/gpu_metrics.csv"
-            output_mem = f"../data/{suite}_solo/{benchmark}/cpu_mem.csv"
-            output_ips = f"../data/{suite}_solo/{benchmark}/cpu_ips.csv"
-            cap_exp(cpu_cap, gpu_cap, output_cpu_power, output_gpu_metrics, output_mem, output_ips)
+            output_cpu_metrics = f"../data/{suite}_solo/{benchmark}/cpu_metrics.csv"
+            output_proc_tree = f"../data/{suite}_solo/{benchmark}/proc_tree.csv"
+            cap_exp(cpu_cap, gpu_cap, output_cpu_power, output_gpu_metrics, output_cpu_metrics, output_proc_tree)
 
 
     # make sure the first run has complete data
@@ -239,6 +253,7 @@ if __name__ == "__main__":
     parser.add_argument('--benchmark_size', type=int, help='0 for big, 1 for small', default=0)
     parser.add_argument('--cap_type', type=int, help='0 for cpu, 1 for gpu, 2 for dual', default=2)
     parser.add_argument('--num_gpu', type=int, default=1)
+    parser.add_argument('--collector', type=int, default=1, help='1: one collector daemon for the sweep, 0: monitor processes per run')
 
     args = parser.parse_args()
     benchmark = args.benchmark
@@ -247,6 +262,17 @@ if __name__ == "__main__":
     benchmark_size = args.benchmark_size
     cap_type = args.cap_type
     num_gpu = args.num_gpu
+    use_collector = args.collector
+
+    collector_process = None
+    if use_collector:
+        # pinned to the reserved power and counter cores for the whole sweep
+        collector_cpus = ",".join(map(str, sib1 + [t_counters]))
+        collector_process = subprocess.Popen(
+            f"echo 9900 | sudo -S taskset -c {collector_cpus} "
+            f"{python_executable} {collector} serve --cpus {collector_cpus} --num_gpu {num_gpu}",
+            shell=True, stdin=subprocess.PIPE, text=True)
+        print(f"collector: {wait_for_collector()}")
 
 
     if suite == 0 or suite ==4:
@@ -325,8 +351,6 @@ if __name__ == "__main__":
             for benchmark in hec_benchmarks:
                 run_benchmark(benchmark_script_dir, benchmark,"hec",test,benchmark_size,cap_type)
 
-
-
-
-
-
+    if collector_process is not None:
+        collector_request({"cmd": "shutdown"})
+        collector_process.wait()
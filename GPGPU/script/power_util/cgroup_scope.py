@@ -0,0 +1,89 @@
+import os
+
+from read_proc_tree import ProcessTree
+
+
+def perf_cgroup_root(mounts="/proc/mounts"):
+    """Mount point perf resolves -G names against: a v1 perf_event hierarchy
+    if one is mounted, else the cgroup2 mount (None if neither exists)."""
+    v2 = None
+    try:
+        with open(mounts) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                if fields[2] == "cgroup" and "perf_event" in fields[3].split(","):
+                    return fields[1]
+                if fields[2] == "cgroup2" and v2 is None:
+                    v2 = fields[1]
+    except OSError:
+        pass
+    return v2
+
+
+class BenchmarkCgroup:
+    """Per-run cgroup holding the benchmark's process tree.
+
+    Counters opened on the cgroup (perf -G, or perf_event_open with
+    PERF_FLAG_PID_CGROUP) only count while its tasks run, so the
+    monitors, the GPU helper core and other node noise drop out.
+    Processes forked after attach() inherit the cgroup automatically.
+    """
+
+    def __init__(self, name, root=None):
+        self.root = root or perf_cgroup_root()
+        if self.root is None:
+            raise RuntimeError("No cgroup2 or perf_event cgroup hierarchy mounted")
+        self.name = name
+        self.path = os.path.join(self.root, name)
+        self.fd = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def attach(self, pids):
+        attached = 0
+        for pid in pids:
+            try:
+                with open(os.path.join(self.path, "cgroup.procs"), "w") as f:
+                    f.write(str(pid))
+                attached += 1
+            except (ProcessLookupError, FileNotFoundError):
+                continue  # exited in the meantime
+        return attached
+
+    def attach_tree(self, root_pid, passes=3):
+        """Move root_pid and every descendant in; repeat so children forked
+        while the first pass ran are picked up too."""
+        tree = ProcessTree(root_pid)
+        seen = set()
+        for _ in range(passes):
+            tree.refresh()
+            new = [pid for pid in tree.pids() if pid not in seen]
+            if not new:
+                break
+            self.attach(new)
+            seen.update(new)
+        return len(seen)
+
+    def open_fd(self):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        return self.fd
+
+    def remove(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        # anything still inside (e.g. a straggler) goes back to the parent first
+        try:
+            with open(os.path.join(self.path, "cgroup.procs")) as f:
+                leftover = f.read().split()
+            for pid in leftover:
+                try:
+                    with open(os.path.join(self.root, "cgroup.procs"), "w") as f:
+                        f.write(pid)
+                except OSError:
+                    pass
+            os.rmdir(self.path)
+        except OSError as e:
+            print(f"Cannot remove cgroup {self.path}: {e}")
@@ -0,0 +1,472 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+import numpy as np
+import psutil
+
+from collector_client import SOCKET_PATH, collector_request
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from gpu_backends import GPU_COLUMNS, make_backend
+from perf_event import PerfEventCounters
+from pid_watch import ExitWatcher
+from read_cpu_counters import CORE_EVENTS, cpu_metrics_header, cpu_metrics_row
+from read_cpu_metrics import MBM_HEADER
+from read_cpu_power import ENERGY_FILES, EnergyCounter, MsrReader, RaplReader, power_trace_header
+from read_gpu_metrics import (DEFAULT_FIELDS, DcgmStream, column_aggregation, field_layout, gpu_headers,
+                              gpu_row, resolve_fields)
+from read_proc_tree import PROC_TREE_HEADER, ProcessTree
+from resctrl_mbm import MbmGroup
+from sampling import DeadlineTicker
+from shm_ring import RingTee, ShmRing, ring_name
+from uncore_pmu import SocketTraffic, UncorePmus
+
+
+class Run:
+    """One armed measurement: the benchmark PID, its outputs and a shared zero time.
+
+    Every sensor reports 'Time (s)' relative to the same monotonic t0, so
+    the files of one run are aligned without any post-hoc offset.
+    """
+
+    def __init__(self, pid, outputs):
+        self.pid = pid
+        self.outputs = outputs
+        self.stop = threading.Event()
+        self.t0 = time.monotonic()
+        self.threads = []
+        self.rows = {}
+        self.errors = {}
+        self.watcher = ExitWatcher(pid).start()
+        # benchmark exit ends the run on its own; every sensor takes a final sample
+        self.watcher.on_exit(self.stop.set)
+
+
+class Sensor:
+    """A data source hosted by the collector.
+
+    open() acquires whatever should live for the whole sweep (fds, perf
+    groups, a dcgmi stream); begin() resets per-run state and end() drops
+    it; sample() returns the rows for one tick, without the time column.
+    The default run() drives sample() from a DeadlineTicker anchored at the
+    run's t0.
+    """
+
+    name = None
+    # rows are all numbers after 'Time (s)', so they can go to a shared-memory ring
+    numeric = True
+    # also sample once when the run is armed, not only after the first interval
+    sample_at_start = False
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def open(self):
+        pass
+
+    def header(self):
+        raise NotImplementedError
+
+    def begin(self, run):
+        pass
+
+    def sample(self, dt, skipped):
+        raise NotImplementedError
+
+    def end(self):
+        pass
+
+    def close(self):
+        pass
+
+    def run(self, run, writer):
+        ticker = DeadlineTicker(self.interval, start=run.t0)
+        self.begin(run)
+        prev = run.t0
+        if self.sample_at_start:
+            prev = time.monotonic()
+            for row in self.sample(max(prev - run.t0, 1e-6), 0):
+                writer.writerow([prev - run.t0] + row)
+        while True:
+            now, skipped = ticker.wait(run.stop)
+            dt = max(now - prev, 1e-6)
+            prev = now
+            for row in self.sample(dt, skipped):
+                writer.writerow([now - run.t0] + row)
+            if run.stop.is_set():
+                break
+
+
+class CpuPowerSensor(Sensor):
+    name = "cpu_power"
+
+    def __init__(self, interval=0.5, backend="sysfs"):
+        super().__init__(interval)
+        self.backend = backend
+        self.reader = None
+
+    def open(self):
+        self.reader = MsrReader() if self.backend == "msr" else RaplReader(ENERGY_FILES)
+
+    def header(self):
+        return power_trace_header(self.reader.keys)
+
+    def begin(self, run):
+        self.counters = {key: EnergyCounter(self.reader.max_ranges[key]) for key in self.reader.keys}
+        for key, raw in zip(self.reader.keys, self.reader.read_all()):
+            self.counters[key].update(raw, 0)
+
+    def sample(self, dt, skipped):
+        energy = {}
+        wrap_suspect = False
+        for key, raw in zip(self.reader.keys, self.reader.read_all()):
+            delta, suspect = self.counters[key].update(raw, dt)
+            energy[key] = delta / 1_000_000
+            wrap_suspect |= suspect
+        cpu = sum(e for key, e in energy.items() if key.startswith("package-"))
+        dram = sum(e for key, e in energy.items() if key.startswith("dram-"))
+        return [[cpu / dt, dram / dt, dt, skipped, int(wrap_suspect), self.reader.last_read_ns / 1000]
+                + [energy[key] / dt for key in self.reader.keys]]
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+
+
+class CpuCounterSensor(Sensor):
+    """IPS, LLC misses and uncore bandwidth through in-process perf_event groups."""
+
+    name = "cpu_metrics"
+
+    def __init__(self, interval=0.5):
+        super().__init__(interval)
+        self.counters = None
+
+    def open(self):
+        self.uncore = UncorePmus()
+        self.counters = PerfEventCounters(core_events=CORE_EVENTS, uncore_events=self.uncore.perf_event_list())
+        self.counters.start()
+
+    def header(self):
+        return cpu_metrics_header(self.uncore)
+
+    def begin(self, run):
+        self.counters.read()  # drop whatever accumulated since the last run
+
+    def sample(self, dt, skipped):
+        values, min_running = self.counters.read()
+        traffic = SocketTraffic.from_counters(self.uncore, self.counters)
+        row = cpu_metrics_row(self.uncore, 0.0, dt, values, traffic)
+        return [row[1:] + [len(self.counters.names), min_running]]
+
+    def close(self):
+        if self.counters is not None:
+            self.counters.close()
+
+
+class PolledGpuSensor(Sensor):
+    name = "gpu_metrics"
+
+    def __init__(self, interval=0.1, backend="nvml", num_gpu=1):
+        super().__init__(interval)
+        self.backend_name = backend
+        self.num_gpu = num_gpu
+        self.backend = None
+
+    def open(self):
+        self.backend = make_backend(self.backend_name, self.num_gpu)
+        self.gpu_ids = self.backend.gpu_ids()
+        self.columns = GPU_COLUMNS + ["Energy (J)"]
+        self.sum_mask, self.power_index = column_aggregation(self.columns)
+
+    def header(self):
+        return gpu_headers(self.columns, len(self.gpu_ids))
+
+    def sample(self, dt, skipped):
+        samples = [self.backend.sample(gpu_id) for gpu_id in self.gpu_ids]
+        block = np.array([[sample[column] for column in self.columns] for sample in samples])
+        return [gpu_row(0.0, block, self.sum_mask, self.power_index)[1:]]
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+
+class DcgmGpuSensor(Sensor):
+    """dcgmi dmon kept streaming for the whole sweep; rows are written only while armed."""
+
+    name = "gpu_metrics"
+
+    def __init__(self, interval=0.1, num_gpu=1, fields=DEFAULT_FIELDS):
+        super().__init__(interval)
+        self.num_gpu = num_gpu
+        self.fields = fields
+        self.stream = None
+
+    def open(self):
+        self.columns, self.order, self.scale = field_layout(self.fields)
+        self.sum_mask, self.power_index = column_aggregation(self.columns)
+        self.stream = DcgmStream(self.fields, delay_ms=int(self.interval * 1000),
+                                 gpu_ids=range(self.num_gpu)).start()
+
+    def header(self):
+        return gpu_headers(self.columns, self.num_gpu)
+
+    def run(self, run, writer):
+        while True:
+            try:
+                item = self.stream.rows.get(timeout=self.interval)
+            except queue.Empty:
+                if run.stop.is_set():
+                    break
+                continue
+            if item is None:
+                break
+            t, block = item
+            if t < run.t0:
+                continue  # queued while the collector was idle
+            writer.writerow(gpu_row(t - run.t0, block[:, self.order] * self.scale, self.sum_mask, self.power_index))
+            if run.stop.is_set():
+                break
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop()
+
+
+class ProcTreeSensor(Sensor):
+    name = "proc_tree"
+    numeric = False
+    # a benchmark shorter than one interval would otherwise leave only the header
+    sample_at_start = True
+
+    def header(self):
+        return PROC_TREE_HEADER
+
+    def begin(self, run):
+        self.tree = ProcessTree(run.pid)
+        self.stop = run.stop
+
+    def sample(self, dt, skipped):
+        return self.tree.snapshot(final=self.stop.is_set())
+
+
+class MbmSensor(Sensor):
+    """Per-workload memory bandwidth from a per-run resctrl monitoring group."""
+
+    name = "mbm"
+
+    def __init__(self, interval=1.0):
+        super().__init__(interval)
+        self.group = None
+
+    def header(self):
+        return MBM_HEADER
+
+    def begin(self, run):
+        self.group = MbmGroup(run.pid)
+        self.prev = self.group.read()
+
+    def sample(self, dt, skipped):
+        self.group.refresh()
+        cur = self.group.read()
+        total = max(cur["mbm_total_bytes"] - self.prev["mbm_total_bytes"], 0) / 1_000_000 / dt
+        local = max(cur["mbm_local_bytes"] - self.prev["mbm_local_bytes"], 0) / 1_000_000 / dt
+        self.prev = cur
+        return [[total, local, max(total - local, 0.0), len(self.group.attached)]]
+
+    def end(self):
+        if self.group is not None:
+            self.group.remove()
+            self.group = None
+
+
+class Collector:
+    """Hosts the sensors for a whole sweep and runs them per armed run."""
+
+    def __init__(self, sensors, fsync_interval=FSYNC_INTERVAL, shm=False):
+        self.sensors = {}
+        self.rings = {}
+        self.fsync_interval = fsync_interval
+        self.run = None
+        self.last = None
+        for sensor in sensors:
+            try:
+                sensor.open()
+                self.sensors[sensor.name] = sensor
+            except Exception as e:
+                print(f"collector: {sensor.name} unavailable: {e}")
+        if shm:
+            # rings live for the whole sweep, so live readers attach once
+            for name, sensor in self.sensors.items():
+                if sensor.numeric:
+                    self.rings[name] = ShmRing.create(ring_name(name), sensor.header()[1:])
+
+    def arm(self, pid, outputs):
+        if self.run is not None and not self.run.stop.is_set():
+            raise RuntimeError("a run is already armed")
+        if not psutil.pid_exists(pid):
+            raise RuntimeError(f"PID {pid} not found")
+        self.wait()
+        t_setup = time.perf_counter()
+        unknown = sorted(set(outputs) - set(self.sensors))
+        run = Run(pid, {name: path for name, path in outputs.items() if name in self.sensors})
+        for name, path in run.outputs.items():
+            sensor = self.sensors[name]
+            writer = StreamingCsvWriter(path, sensor.header(), fsync_interval=self.fsync_interval)
+            writer.set_start(run.t0)
+            if name in self.rings:
+                writer = RingTee(writer, self.rings[name], run.t0)
+            thread = threading.Thread(target=self._run_sensor, args=(run, sensor, writer), name=name, daemon=True)
+            run.threads.append(thread)
+        for thread in run.threads:
+            thread.start()
+        self.run = run
+        return {"sensors": sorted(run.outputs), "unavailable": unknown,
+                "setup_ms": (time.perf_counter() - t_setup) * 1000}
+
+    def _run_sensor(self, run, sensor, writer):
+        try:
+            sensor.run(run, writer)
+        except Exception as e:
+            run.errors[sensor.name] = str(e)
+        finally:
+            sensor.end()
+            writer.close()
+            run.rows[sensor.name] = writer.rows
+
+    def disarm(self):
+        if self.run is not None:
+            self.run.stop.set()
+        return self.wait()
+
+    def wait(self, timeout=None):
+        run = self.run
+        if run is None:
+            return {}
+        for thread in run.threads:
+            thread.join(timeout)
+        self.last = run
+        # up to the benchmark exit, not up to whenever the client asked
+        end = run.watcher.end_time if run.watcher.exited.is_set() else time.monotonic()
+        return {"rows": run.rows, "errors": run.errors, "duration_s": end - run.t0}
+
+    def status(self):
+        armed = self.run is not None and not self.run.stop.is_set()
+        return {"sensors": sorted(self.sensors), "armed": armed, "pid": self.run.pid if armed else None}
+
+    def close(self):
+        self.disarm()
+        for sensor in self.sensors.values():
+            sensor.close()
+        for ring in self.rings.values():
+            ring.close()
+
+    def handle(self, request):
+        cmd = request.get("cmd")
+        if cmd == "arm":
+            return self.arm(int(request["pid"]), request["outputs"])
+        if cmd == "disarm":
+            return self.disarm()
+        if cmd == "wait":
+            return self.wait()
+        if cmd == "status":
+            return self.status()
+        raise ValueError(f"unknown command {cmd!r}")
+
+    def serve(self, socket_path=SOCKET_PATH):
+        """Answer one JSON request per line on a local Unix socket until 'shutdown'."""
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        # started through sudo: let the invoking user (exp_solo) connect
+        if "SUDO_UID" in os.environ:
+            os.chown(socket_path, int(os.environ["SUDO_UID"]), int(os.environ["SUDO_GID"]))
+        os.chmod(socket_path, 0o600)
+        server.listen(4)
+        print(f"collector: serving {', '.join(sorted(self.sensors))} on {socket_path}")
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn, conn.makefile("rw") as stream:
+                    for line in stream:
+                        try:
+                            request = json.loads(line)
+                            if request.get("cmd") == "shutdown":
+                                stream.write(json.dumps({"ok": True}) + "\n")
+                                stream.flush()
+                                return
+                            reply = {"ok": True, **self.handle(request)}
+                        except Exception as e:
+                            reply = {"ok": False, "error": str(e)}
+                        stream.write(json.dumps(reply) + "\n")
+                        stream.flush()
+        finally:
+            server.close()
+            os.unlink(socket_path)
+            self.close()
+
+
+def build_sensors(args):
+    sensors = [CpuPowerSensor(args.cpu_interval, args.rapl_backend), ProcTreeSensor(args.proc_interval)]
+    if not args.no_counters:
+        sensors.append(CpuCounterSensor(args.counter_interval))
+    if args.mbm:
+        sensors.append(MbmSensor(args.mbm_interval))
+    if args.num_gpu > 0:
+        if args.gpu_backend == "dcgm":
+            sensors.append(DcgmGpuSensor(args.gpu_interval, args.num_gpu, resolve_fields(args.fields)))
+        else:
+            sensors.append(PolledGpuSensor(args.gpu_interval, args.gpu_backend, args.num_gpu))
+    return sensors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Single-process collector for CPU power, CPU counters, GPU metrics '
+                                                 'and the process tree, armed per run over a Unix socket.')
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Start the collector daemon")
+    serve.add_argument("--socket", type=str, default=SOCKET_PATH, help="Control socket path")
+    serve.add_argument("--cpus", type=str, default=None, help="Pin the collector to these CPUs, e.g. 1,65")
+    serve.add_argument("--cpu_interval", type=float, default=0.5, help="RAPL sampling interval in seconds")
+    serve.add_argument("--rapl_backend", type=str, default="sysfs", choices=["sysfs", "msr"])
+    serve.add_argument("--counter_interval", type=float, default=0.5, help="CPU counter sampling interval in seconds")
+    serve.add_argument("--no_counters", action="store_true", help="Do not host the perf_event CPU counter sensor")
+    serve.add_argument("--mbm", action="store_true", help="Host the resctrl MBM sensor (one monitoring group per run)")
+    serve.add_argument("--mbm_interval", type=float, default=1.0, help="MBM sampling interval in seconds")
+    serve.add_argument("--proc_interval", type=float, default=1.0, help="Process tree sampling interval in seconds")
+    serve.add_argument("--num_gpu", type=int, default=1, help="GPUs to sample (0 disables the GPU sensor)")
+    serve.add_argument("--gpu_interval", type=float, default=0.1, help="GPU sampling interval in seconds")
+    serve.add_argument("--gpu_backend", type=str, default="dcgm", choices=["dcgm", "nvml", "fake"])
+    serve.add_argument("--fields", type=str, default="default", help="DCGM preset or comma-separated field ids")
+    serve.add_argument("--shm", action="store_true",
+                       help="Also publish every sample to shared-memory rings (see shm_ring.py)")
+    serve.add_argument("--fsync_interval", type=float, default=FSYNC_INTERVAL, help="Seconds between fsyncs of the output CSVs")
+
+    arm = sub.add_parser("arm", help="Start recording a run")
+    arm.add_argument("--socket", type=str, default=SOCKET_PATH)
+    arm.add_argument("--pid", type=int, required=True, help="PID of the benchmark process")
+    arm.add_argument("--output", action="append", default=[], metavar="SENSOR=CSV",
+                     help="Output file per sensor (cpu_power, cpu_metrics, gpu_metrics, proc_tree, mbm); repeatable")
+
+    for name in ("disarm", "wait", "status", "shutdown"):
+        ctl = sub.add_parser(name)
+        ctl.add_argument("--socket", type=str, default=SOCKET_PATH)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if args.cpus:
+            os.sched_setaffinity(0, {int(cpu) for cpu in args.cpus.split(",")})
+        exit_on_sigterm()
+        Collector(build_sensors(args), args.fsync_interval, args.shm).serve(args.socket)
+    elif args.command == "arm":
+        outputs = dict(item.split("=", 1) for item in args.output)
+        print(collector_request({"cmd": "arm", "pid": args.pid, "outputs": outputs}, args.socket))
+    else:
+        print(collector_request({"cmd": args.command}, args.socket))
@@ -0,0 +1,28 @@
+import json
+import socket
+import time
+
+# Kept free of sensor imports so exp_solo can talk to the collector cheaply
+SOCKET_PATH = "/tmp/power_collector.sock"
+
+
+def collector_request(request, socket_path=SOCKET_PATH, timeout=None):
+    """Send one request to a running collector and return its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(socket_path)
+        with conn.makefile("rw") as stream:
+            stream.write(json.dumps(request) + "\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+def wait_for_collector(socket_path=SOCKET_PATH, timeout=30.0):
+    """Poll until the collector answers 'status'; return that reply."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return collector_request({"cmd": "status"}, socket_path, timeout=1.0)
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"collector did not come up on {socket_path}")
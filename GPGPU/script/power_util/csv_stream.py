@@ -0,0 +1,90 @@
+import csv
+import json
+import os
+import signal
+import sys
+import time
+
+FLUSH_ROWS = 64         # rows buffered in memory before they are written out
+FSYNC_INTERVAL = 5.0    # seconds between fsyncs; 0 fsyncs on every flush
+START_SUFFIX = '.start'  # sidecar holding the origin of a CSV's 'Time (s)' column
+
+
+class StreamingCsvWriter:
+    """Append-only CSV writer that keeps memory constant over any run length.
+
+    Rows are buffered in a small list and written every `flush_rows` rows
+    or every `fsync_interval` seconds, whichever comes first, and each
+    time-based write is fsynced, so a monitor that gets killed loses at
+    most fsync_interval seconds of samples even at slow sample rates.
+    """
+
+    def __init__(self, output_csv, header, flush_rows=FLUSH_ROWS, fsync_interval=FSYNC_INTERVAL):
+        os.makedirs(os.path.dirname(output_csv) or '.', exist_ok=True)
+        self.path = output_csv
+        self.file = open(output_csv, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(header)
+        self.flush_rows = flush_rows
+        self.fsync_interval = fsync_interval
+        self.pending = []
+        self.rows = 0
+        self.last_fsync = time.monotonic()
+
+    def set_start(self, t0):
+        """Record the time.monotonic() that 'Time (s)' counts from in <csv>.start.
+
+        Every monitor has its own origin; merge_traces.py uses the sidecars
+        to put all files of one run on a common timebase.
+        """
+        wall = time.time() - (time.monotonic() - t0)
+        with open(self.path + START_SUFFIX, 'w') as f:
+            json.dump({'monotonic': t0, 'wall': wall}, f)
+
+    def writerow(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.flush_rows or time.monotonic() - self.last_fsync >= self.fsync_interval:
+            self.flush()
+
+    def flush(self, sync=False):
+        if self.file is None:
+            return
+        if self.pending:
+            self.writer.writerows(self.pending)
+            self.rows += len(self.pending)
+            self.pending.clear()
+        self.file.flush()
+        now = time.monotonic()
+        if sync or now - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_fsync = now
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush(sync=True)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_start(output_csv):
+    """The sidecar written by set_start() as a dict, or None for older traces."""
+    try:
+        with open(output_csv + START_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def exit_on_sigterm():
+    """Turn SIGTERM/SIGHUP into SystemExit so `with StreamingCsvWriter(...)` blocks flush on kill."""
+    def handler(signum, frame):
+        sys.exit(128 + signum)
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGHUP, handler)
@@ -0,0 +1,132 @@
+import math
+import re
+
+# Core events served by Intel's fixed counters; they never take a general-purpose slot
+FIXED_EVENTS = {"instructions", "cycles", "cpu-cycles", "ref-cycles"}
+# General-purpose counters per logical CPU on pre-Ice Lake Intel cores, by SMT state
+GP_COUNTERS_SMT = 4
+GP_COUNTERS_NO_SMT = 8
+# From Ice Lake on every logical CPU has 8, SMT or not; keyed by the kernel's caps/pmu_name
+PMU_GP_COUNTERS = {
+    "icelake": 8,
+    "icelake_server": 8,
+    "sapphire_rapids": 8,
+    "granite_rapids": 8,
+    "alderlake_hybrid": 8,
+    "meteorlake_hybrid": 8,
+}
+# hybrid parts name the P-core PMU cpu_core instead of cpu
+PMU_NAME_PATHS = ("/sys/bus/event_source/devices/cpu/caps/pmu_name",
+                  "/sys/bus/event_source/devices/cpu_core/caps/pmu_name")
+# Counters per uncore box (IMC channel, CHA, UPI link)
+UNCORE_COUNTERS = 4
+
+
+def gp_counter_count(smt_path="/sys/devices/system/cpu/smt/active", pmu_name_paths=PMU_NAME_PATHS):
+    """General-purpose counters per logical CPU: by core PMU name, else by SMT state."""
+    for path in pmu_name_paths:
+        try:
+            with open(path) as f:
+                name = f.read().strip()
+        except OSError:
+            continue
+        if name in PMU_GP_COUNTERS:
+            return PMU_GP_COUNTERS[name]
+    try:
+        with open(smt_path) as f:
+            return GP_COUNTERS_SMT if f.read().strip() == "1" else GP_COUNTERS_NO_SMT
+    except OSError:
+        return GP_COUNTERS_SMT
+
+
+def event_pmu(event):
+    """'uncore_imc_0/cas_count_read/' -> 'uncore_imc_0'; core events -> 'cpu'."""
+    if "/" in event:
+        pmu = event.split("/", 1)[0]
+        if pmu.startswith("uncore_"):
+            return pmu
+    return "cpu"
+
+
+def plan_event_groups(events, gp_counters=None):
+    """Split events into perf groups that each fit the hardware at once.
+
+    Core events fill groups of gp_counters general-purpose slots, with each
+    fixed-counter event riding along in the first group. Uncore events are
+    grouped per box since every box has its own counters. Groups are
+    returned in request order; a run multiplexes only if more than one core
+    group comes back (see expected_running).
+    """
+    gp_counters = gp_counters or gp_counter_count()
+    core_groups = []
+    uncore_groups = {}
+    fixed = []
+    for event in events:
+        pmu = event_pmu(event)
+        if pmu != "cpu":
+            boxes = uncore_groups.setdefault(pmu, [[]])
+            if len(boxes[-1]) == UNCORE_COUNTERS:
+                boxes.append([])
+            boxes[-1].append(event)
+        elif event in FIXED_EVENTS:
+            fixed.append(event)
+        else:
+            if not core_groups or len(core_groups[-1]) == gp_counters:
+                core_groups.append([])
+            core_groups[-1].append(event)
+    if fixed:
+        if core_groups:
+            core_groups[0] = fixed + core_groups[0]
+        else:
+            core_groups.append(fixed)
+    groups = list(core_groups)
+    for boxes in uncore_groups.values():
+        groups.extend(boxes)
+    return groups
+
+
+def expected_running(groups):
+    """Fraction of time each core group is expected to be scheduled (1.0 = no multiplexing)."""
+    core = sum(1 for g in groups if event_pmu(g[0]) == "cpu")
+    uncore = {}
+    for g in groups:
+        if event_pmu(g[0]) != "cpu":
+            uncore[event_pmu(g[0])] = uncore.get(event_pmu(g[0]), 0) + 1
+    return 1.0 / max([core, 1] + list(uncore.values()))
+
+
+def perf_group_args(groups):
+    """['-e', '{a,b}', '-e', 'c', ...] for perf stat; single events need no braces."""
+    args = []
+    for g in groups:
+        args += ["-e", g[0] if len(g) == 1 else "{" + ",".join(g) + "}"]
+    return args
+
+
+def describe_plan(groups):
+    running = expected_running(groups)
+    note = "no multiplexing" if running >= 1.0 else f"multiplexed, ~{math.floor(running * 100)}% running each"
+    return f"{sum(map(len, groups))} events in {len(groups)} group(s), {note}"
+
+
+def split_events(text):
+    """Split a comma-separated event list, keeping commas inside pmu/.../ terms."""
+    events, current, in_pmu = [], "", False
+    for ch in text:
+        if ch == "/":
+            in_pmu = not in_pmu
+        if ch == "," and not in_pmu:
+            if current:
+                events.append(current)
+            current = ""
+        else:
+            current += ch
+    if current:
+        events.append(current)
+    return events
+
+
+def event_name(event):
+    """Name perf prints for an event: the name= term if given, else the event string."""
+    m = re.search(r"name=([^,/]+)", event)
+    return m.group(1) if m else event
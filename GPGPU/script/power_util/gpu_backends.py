@@ -0,0 +1,109 @@
+import math
+import time
+
+# Columns every polled backend fills, in gpu_metrics.csv order after 'Time (s)'
+GPU_COLUMNS = ['SM Clock (MHz)', 'DRAM Active', 'FP16 Active', 'FP32 Active', 'FP64 Active', 'Power (W)']
+
+
+class GpuBackend:
+    """In-process source of GPU samples for read_gpu_metrics.
+
+    sample(gpu_id) returns {column: value} using the gpu_metrics.csv column
+    names (plus 'Energy (J)', the cumulative energy counter). Backends are
+    polled by the sampling loop, so anything implementing these three
+    methods can stand in for real hardware.
+    """
+
+    def gpu_ids(self):
+        raise NotImplementedError
+
+    def sample(self, gpu_id):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NvmlBackend(GpuBackend):
+    """NVML through the pynvml bindings; cheap enough to poll at up to 1 kHz.
+
+    NVML has no per-pipe activity counters, so the FP16/FP32/FP64 columns
+    are 0; use the DCGM backend when those are needed.
+    """
+
+    def __init__(self, num_gpu=1):
+        try:
+            import pynvml
+        except ImportError:
+            raise RuntimeError("NVML backend needs the pynvml package (pip install nvidia-ml-py)")
+        self.nvml = pynvml
+        pynvml.nvmlInit()
+        count = min(num_gpu, pynvml.nvmlDeviceGetCount())
+        self.handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(count)]
+
+    def gpu_ids(self):
+        return list(range(len(self.handles)))
+
+    def sample(self, gpu_id):
+        nvml = self.nvml
+        h = self.handles[gpu_id]
+        return {
+            'SM Clock (MHz)': float(nvml.nvmlDeviceGetClockInfo(h, nvml.NVML_CLOCK_SM)),
+            'DRAM Active': nvml.nvmlDeviceGetUtilizationRates(h).memory / 100,
+            'FP16 Active': 0.0,
+            'FP32 Active': 0.0,
+            'FP64 Active': 0.0,
+            'Power (W)': nvml.nvmlDeviceGetPowerUsage(h) / 1000,
+            'Energy (J)': nvml.nvmlDeviceGetTotalEnergyConsumption(h) / 1000,
+        }
+
+    def close(self):
+        self.nvml.nvmlShutdown()
+
+
+class FakeGpuBackend(GpuBackend):
+    """Pure-Python stand-in device for CPU-only machines.
+
+    Values follow a slow deterministic load cycle so the sampling loop,
+    pacing and CSV output can be exercised without a GPU. Energy is the
+    exact integral of the reported power.
+    """
+
+    def __init__(self, num_gpu=1, idle_w=60.0, peak_w=250.0, period_s=2.0):
+        self.num_gpu = num_gpu
+        self.idle_w = idle_w
+        self.peak_w = peak_w
+        self.period_s = period_s
+        self.start = time.monotonic()
+
+    def gpu_ids(self):
+        return list(range(self.num_gpu))
+
+    def load(self, t, gpu_id):
+        return 0.5 - 0.5 * math.cos(2 * math.pi * (t / self.period_s + gpu_id / max(self.num_gpu, 1)))
+
+    def sample(self, gpu_id):
+        t = time.monotonic() - self.start
+        load = self.load(t, gpu_id)
+        swing = self.peak_w - self.idle_w
+        # integral of idle + swing * load(t) from 0 to t
+        w = 2 * math.pi / self.period_s
+        phase = 2 * math.pi * gpu_id / max(self.num_gpu, 1)
+        energy = self.idle_w * t + swing * (0.5 * t - 0.5 * (math.sin(w * t + phase) - math.sin(phase)) / w)
+        return {
+            'SM Clock (MHz)': 765.0 + 645.0 * load,
+            'DRAM Active': 0.4 * load,
+            'FP16 Active': 0.0,
+            'FP32 Active': 0.6 * load,
+            'FP64 Active': 0.1 * load,
+            'Power (W)': self.idle_w + swing * load,
+            'Energy (J)': energy,
+        }
+
+
+def make_backend(name, num_gpu=1):
+    if name == 'nvml':
+        return NvmlBackend(num_gpu)
+    if name == 'fake':
+        return FakeGpuBackend(num_gpu)
+    raise ValueError(f"Unknown polled GPU backend: {name}")
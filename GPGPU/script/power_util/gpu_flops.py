@@ -0,0 +1,97 @@
+import argparse
+import os
+import re
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+# Non-tensor-core FLOPs per SM per clock (an FMA counts as 2) by device model.
+# Matched as a substring of the device name nvidia-smi reports, most specific
+# key first: 'H100 PCIe' has fewer SMs than the SXM part ('H100 80GB HBM3').
+GPU_SPECS = {
+    'H100 PCIe': {'sms': 114, 'FP64': 128, 'FP32': 256, 'FP16': 512},
+    'H100': {'sms': 132, 'FP64': 128, 'FP32': 256, 'FP16': 512},
+    'A100': {'sms': 108, 'FP64': 64, 'FP32': 128, 'FP16': 512},
+    'A30': {'sms': 56, 'FP64': 64, 'FP32': 128, 'FP16': 512},
+    'V100': {'sms': 80, 'FP64': 64, 'FP32': 128, 'FP16': 256},
+}
+PRECISIONS = ['FP16', 'FP32', 'FP64']
+
+
+def detect_gpu_model():
+    try:
+        out = subprocess.run(['nvidia-smi', '--query-gpu=name', '--format=csv,noheader'],
+                             capture_output=True, text=True).stdout
+    except OSError:
+        return None
+    return out.splitlines()[0].strip() if out.strip() else None
+
+
+def lookup_spec(model):
+    for key in sorted(GPU_SPECS, key=len, reverse=True):
+        if key.upper() in model.upper():
+            return GPU_SPECS[key]
+    raise ValueError(f"No GPU spec for '{model}'; known models: {', '.join(GPU_SPECS)}")
+
+
+def gpu_flops(df, prefix, spec):
+    """{precision: FLOPS} for one device's (or the aggregate) activity and SM clock columns."""
+    clock_hz = df[f'{prefix}SM Clock (MHz)'].to_numpy(dtype=float) * 1e6
+    peak_per_active = clock_hz * spec['sms']
+    return {precision: df[f'{prefix}{precision} Active'].to_numpy(dtype=float) * peak_per_active * spec[precision]
+            for precision in PRECISIONS}
+
+
+def add_flops_columns(df, spec):
+    """Add achieved TFLOPS per precision and energy per FLOP, in one vectorized pass.
+
+    DCGM's FP*_ACTIVE is the fraction of cycles the pipe was busy averaged
+    over all SMs, so achieved = activity * peak at the sampled SM clock.
+    With per-GPU 'GPU<i> ...' columns each device uses its own activity
+    and clock and the node columns (the unprefixed ones) are their sum;
+    a single-GPU or aggregate-only trace uses the node columns directly.
+    """
+    gpu_prefixes = sorted({m.group(1) for m in map(re.compile(r'(GPU\d+ )SM Clock').match, df.columns) if m})
+    out = {}
+
+    def add(prefix, flops):
+        total = sum(flops.values())
+        for precision in PRECISIONS:
+            out[f'{prefix}{precision} TFLOPS'] = flops[precision] / 1e12
+        out[f'{prefix}Total TFLOPS'] = total / 1e12
+        power = df[f'{prefix}Power (W)'].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[f'{prefix}Energy per FLOP (pJ)'] = np.where(total > 0, power / total * 1e12, np.nan)
+
+    if gpu_prefixes:
+        per_gpu = {prefix: gpu_flops(df, prefix, spec) for prefix in gpu_prefixes}
+        node = {precision: sum(flops[precision] for flops in per_gpu.values()) for precision in PRECISIONS}
+    else:
+        per_gpu = {}
+        node = gpu_flops(df, '', spec)
+    add('', node)
+    for prefix, flops in per_gpu.items():
+        add(prefix, flops)
+    return pd.concat([df, pd.DataFrame(out, index=df.index)], axis=1)
+
+
+def derive(input_csv, output_csv, model):
+    df = pd.read_csv(input_csv)
+    add_flops_columns(df, lookup_spec(model)).to_csv(output_csv, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Derive achieved FLOPS and energy per FLOP from gpu_metrics.csv traces.')
+    parser.add_argument('input_csv', nargs='+', help='gpu_metrics.csv file(s)')
+    parser.add_argument('--gpu_model', type=str, default=None,
+                        help=f'Device model ({", ".join(GPU_SPECS)}); detected with nvidia-smi if omitted')
+    parser.add_argument('--suffix', type=str, default='_flops', help='Suffix for the output file name')
+    args = parser.parse_args()
+
+    model = args.gpu_model or detect_gpu_model()
+    if model is None:
+        parser.error('could not detect the GPU model, pass --gpu_model')
+    for input_csv in args.input_csv:
+        root, ext = os.path.splitext(input_csv)
+        derive(input_csv, f"{root}{args.suffix}{ext}", model)
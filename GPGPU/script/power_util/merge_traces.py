@@ -0,0 +1,160 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from csv_stream import read_start
+
+MERGED_CSV = "merged.csv"
+# proc_tree.csv has one row per process per tick, so it has no single value to resample
+SKIP_FILES = {MERGED_CSV, "proc_tree.csv"}
+# outputs derived from a trace (gpu_flops.py) would only duplicate its columns
+SKIP_SUFFIXES = ("_flops.csv",)
+DEFAULT_STEP = 0.1
+# Counts, flags and per-sample bookkeeping are held, never interpolated
+HOLD_COLUMNS = {"Sample dt (s)", "Skipped Ticks", "Wrap Suspect", "Read Latency (us)", "Counted Events",
+                "Min Running (%)", "Attached Tasks"}
+HOLD_SUFFIXES = ("Running (%)",)
+
+
+def hold_mask(columns, hold=(), linear=()):
+    """True for columns resampled by zero-order hold, False for linear interpolation.
+
+    hold/linear are substrings that override the defaults; linear wins.
+    """
+    mask = []
+    for column in columns:
+        use_hold = column in HOLD_COLUMNS or column.endswith(HOLD_SUFFIXES) or any(h in column for h in hold)
+        if any(l in column for l in linear):
+            use_hold = False
+        mask.append(use_hold)
+    return np.array(mask, dtype=bool)
+
+
+def is_trace(name, output=MERGED_CSV):
+    return name.endswith(".csv") and name not in SKIP_FILES and name != output and not name.endswith(SKIP_SUFFIXES)
+
+
+def load_stream(path):
+    """(times, columns, values) of a per-tick trace, or None if it is not one."""
+    try:
+        df = pd.read_csv(path)
+    except (OSError, ValueError, pd.errors.EmptyDataError):
+        return None
+    if "Time (s)" not in df.columns or df.empty:
+        return None  # e.g. the --avg summary of read_cpu_power
+    t = pd.to_numeric(df["Time (s)"], errors="coerce").to_numpy(dtype=float)
+    if np.isnan(t).any() or (np.diff(t) <= 0).any():
+        return None  # several rows per tick (long format) or a damaged file
+    values = df.drop(columns="Time (s)")
+    # only text columns need coercing; a per-column pass over all of them dominates the load
+    for column in values.columns[values.dtypes == object]:
+        values[column] = pd.to_numeric(values[column], errors="coerce")
+    return t, list(values.columns), values.to_numpy(dtype=float)
+
+
+def resample(t, values, grid, hold):
+    """Resample (len(t), n) values onto grid; NaN outside [t[0], t[-1]].
+
+    Held columns take the last sample at or before each grid point, the
+    rest are interpolated linearly between the neighbouring samples.
+    """
+    out = np.full((len(grid), values.shape[1]), np.nan)
+    inside = (grid >= t[0]) & (grid <= t[-1])
+    g = grid[inside]
+    prev = np.searchsorted(t, g, side="right") - 1
+    nxt = np.minimum(prev + 1, len(t) - 1)
+    span = t[nxt] - t[prev]
+    w = np.divide(g - t[prev], span, out=np.zeros_like(g), where=span > 0)
+    held = values[prev]
+    linear = held + (values[nxt] - held) * w[:, None]
+    out[inside] = np.where(hold, held, linear)
+    return out
+
+
+def merge_run(run_dir, step=DEFAULT_STEP, hold=(), linear=(), output=MERGED_CSV):
+    """Write one wide table of every trace in run_dir on a common time grid.
+
+    Each trace's 'Time (s)' is shifted by its <csv>.start origin, so 0 on
+    the grid is the earliest monitor start. Traces without a sidecar
+    (recorded before it existed) are assumed to start with the earliest
+    one. Columns are named '<file stem>/<column>'. Returns the row count.
+    """
+    streams = []
+    for name in sorted(os.listdir(run_dir)):
+        if not is_trace(name, output):
+            continue
+        path = os.path.join(run_dir, name)
+        stream = load_stream(path)
+        if stream is None:
+            continue
+        start = read_start(path)
+        streams.append((name[:-4], start["monotonic"] if start else None) + stream)
+    if not streams:
+        return 0
+
+    known = [start for _, start, _, _, _ in streams if start is not None]
+    origin = min(known) if known else 0.0
+    missing = [stem for stem, start, _, _, _ in streams if start is None]
+    if missing and known:
+        print(f"merge_traces: {run_dir}: no start offset for {', '.join(missing)}, assuming it started first")
+
+    shifted = [(stem, t + ((start if start is not None else origin) - origin), columns, values)
+               for stem, start, t, columns, values in streams]
+    end = max(t[-1] for _, t, _, _ in shifted)
+    grid = np.arange(0.0, end + step / 2, step)
+
+    names = ["Time (s)"]
+    blocks = [grid[:, None]]
+    for stem, t, columns, values in shifted:
+        names += [f"{stem}/{column}" for column in columns]
+        blocks.append(resample(t, values, grid, hold_mask(columns, hold, linear)))
+    merged = np.hstack(blocks)
+    # np.savetxt is ~3x faster than DataFrame.to_csv here; NaN is written as 'nan', which read_csv accepts
+    np.savetxt(os.path.join(run_dir, output), merged, fmt="%.9g", delimiter=",", header=",".join(names), comments="")
+    return len(merged)
+
+
+def find_runs(paths, output=MERGED_CSV):
+    """Directories under paths that hold at least one trace CSV."""
+    runs = []
+    for path in paths:
+        for root, _, files in os.walk(path):
+            if any(is_trace(f, output) for f in files):
+                runs.append(root)
+    return sorted(runs)
+
+
+def _merge_one(job):
+    run_dir, step, hold, linear, output = job
+    try:
+        return run_dir, merge_run(run_dir, step, hold, linear, output), None
+    except Exception as e:
+        return run_dir, 0, str(e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Resample every trace of a run onto one time grid and write '
+                                                 'a single wide table per run directory.')
+    parser.add_argument('paths', nargs='+', help='Run directories, or data directories to search for runs')
+    parser.add_argument('--step', type=float, default=DEFAULT_STEP, help='Grid spacing in seconds')
+    parser.add_argument('--hold', action='append', default=[],
+                        help='Resample columns containing this text by zero-order hold (repeatable)')
+    parser.add_argument('--linear', action='append', default=[],
+                        help='Interpolate columns containing this text linearly (repeatable, wins over --hold)')
+    parser.add_argument('--output', type=str, default=MERGED_CSV, help='File name written into each run directory')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Runs merged in parallel')
+    args = parser.parse_args()
+
+    runs = find_runs(args.paths, args.output)
+    jobs = [(run_dir, args.step, args.hold, args.linear, args.output) for run_dir in runs]
+    merged = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for run_dir, rows, error in pool.map(_merge_one, jobs, chunksize=16):
+            if error:
+                print(f"merge_traces: {run_dir}: {error}")
+            elif rows:
+                merged += 1
+    print(f"merge_traces: merged {merged} of {len(runs)} runs")
@@ -0,0 +1,296 @@
+import ctypes
+import os
+import platform
+import struct
+import time
+
+from pid_watch import ExitWatcher
+from sampling import DeadlineTicker
+from uncore_pmu import CPU_ROOT, PMU_ROOT, parse_cpu_list
+
+# perf_event_open(2) constants from linux/perf_event.h
+SYS_PERF_EVENT_OPEN = {"x86_64": 298, "aarch64": 241}.get(platform.machine())
+
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_HW_CACHE = 3
+
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_GROUP = 1 << 3
+READ_FORMAT = PERF_FORMAT_GROUP | PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING
+
+ATTR_FLAG_DISABLED = 1 << 0
+
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+PERF_EVENT_IOC_RESET = 0x2403
+PERF_IOC_FLAG_GROUP = 1
+
+# perf_event_open flags argument: pid is an fd of a cgroup directory
+PERF_FLAG_PID_CGROUP = 1 << 2
+
+# perf's generic core events; LLC-misses is the LL cache read-miss hw-cache event
+CORE_EVENTS = {
+    "instructions": (PERF_TYPE_HARDWARE, 1),
+    "cycles": (PERF_TYPE_HARDWARE, 0),
+    "cache-misses": (PERF_TYPE_HARDWARE, 3),
+    "LLC-misses": (PERF_TYPE_HW_CACHE, 2 | (0 << 8) | (1 << 16)),
+}
+
+
+class PerfEventAttr(ctypes.Structure):
+    # PERF_ATTR_SIZE_VER5 layout; the kernel accepts any published size
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+        ("branch_sample_type", ctypes.c_uint64),
+        ("sample_regs_user", ctypes.c_uint64),
+        ("sample_stack_user", ctypes.c_uint32),
+        ("clockid", ctypes.c_int32),
+        ("sample_regs_intr", ctypes.c_uint64),
+        ("aux_watermark", ctypes.c_uint32),
+        ("sample_max_stack", ctypes.c_uint16),
+        ("reserved_2", ctypes.c_uint16),
+    ]
+
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.syscall.restype = ctypes.c_long
+_libc.ioctl.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ulong]
+
+
+def perf_event_open(type_, config, pid=-1, cpu=-1, group_fd=-1, flags=0, config1=0, config2=0, open_flags=0):
+    if SYS_PERF_EVENT_OPEN is None:
+        raise OSError(f"perf_event_open syscall number unknown for {platform.machine()}")
+    attr = PerfEventAttr()
+    attr.type = type_
+    attr.size = ctypes.sizeof(PerfEventAttr)
+    attr.config = config
+    attr.config1 = config1
+    attr.config2 = config2
+    attr.read_format = READ_FORMAT
+    attr.flags = flags
+    fd = _libc.syscall(SYS_PERF_EVENT_OPEN, ctypes.byref(attr), pid, cpu, group_fd, open_flags)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f"perf_event_open(type={type_}, config={config:#x}, cpu={cpu}): {os.strerror(err)}")
+    return fd
+
+
+def read_sysfs(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def encode_event(pmu, event, spec=None, root=PMU_ROOT):
+    """Resolve a PMU event to (type, config, config1, config2, scale, unit).
+
+    `spec` is a raw term list such as "event=0x2,umask=0xf"; without it the
+    sysfs alias pmu/events/<event> is used. Terms are packed into config
+    words with the PMU's format/ bit fields, like perf's parser does.
+    """
+    pmu_dir = os.path.join(root, pmu)
+    pmu_type = int(read_sysfs(os.path.join(pmu_dir, "type")))
+    if spec is None:
+        spec = read_sysfs(os.path.join(pmu_dir, "events", event))
+    if spec is None:
+        raise OSError(f"{pmu} has no event {event}")
+    configs = {"config": 0, "config1": 0, "config2": 0}
+    for term in spec.split(","):
+        name, _, value = term.partition("=")
+        value = int(value, 0) if value else 1
+        fmt = read_sysfs(os.path.join(pmu_dir, "format", name.strip()))
+        if fmt is None:
+            raise OSError(f"{pmu} has no format field {name}")
+        field, _, ranges = fmt.partition(":")
+        shift = 0
+        for r in ranges.split(","):
+            lo, _, hi = r.partition("-")
+            lo = int(lo)
+            hi = int(hi) if hi else lo
+            width = hi - lo + 1
+            configs[field] |= ((value >> shift) & ((1 << width) - 1)) << lo
+            shift += width
+    scale = float(read_sysfs(os.path.join(pmu_dir, "events", f"{event}.scale"), "1"))
+    unit = read_sysfs(os.path.join(pmu_dir, "events", f"{event}.unit"), "")
+    return pmu_type, configs["config"], configs["config1"], configs["config2"], scale, unit
+
+
+class PerfGroup:
+    """Counters opened as one perf group on a single CPU (or task).
+
+    The group is read with one read() of PERF_FORMAT_GROUP into a
+    preallocated buffer: nr, time_enabled, time_running, then one value per
+    member. Deltas are scaled by enabled/running when the kernel multiplexed
+    the group, exactly as perf stat does.
+    """
+
+    def __init__(self, events, pid=-1, cpu=-1, flags=0, open_flags=0):
+        # events: list of (name, type, config, config1, config2, scale)
+        self.cpu = cpu
+        self.names = [e[0] for e in events]
+        self.scales = [e[5] for e in events]
+        self.fds = []
+        try:
+            for name, type_, config, config1, config2, scale in events:
+                leader = self.fds[0] if self.fds else -1
+                member_flags = flags | (ATTR_FLAG_DISABLED if leader == -1 else 0)
+                self.fds.append(perf_event_open(type_, config, pid, cpu, leader, member_flags, config1, config2,
+                                                open_flags))
+        except OSError:
+            self.close()
+            raise
+        self.layout = struct.Struct(f"={3 + len(events)}Q")
+        self.buf = bytearray(self.layout.size)
+        self.prev = None
+        self.last_deltas = [0.0] * len(events)
+
+    def enable(self):
+        _libc.ioctl(self.fds[0], PERF_EVENT_IOC_RESET, PERF_IOC_FLAG_GROUP)
+        _libc.ioctl(self.fds[0], PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP)
+        self.prev = self.layout.unpack_from(self.read_raw())
+
+    def read_raw(self):
+        os.readv(self.fds[0], [self.buf])
+        return self.buf
+
+    def read_delta(self):
+        """Return ([scaled delta per member], enabled ns, running ns) since the last read."""
+        cur = self.layout.unpack_from(self.read_raw())
+        prev = self.prev
+        self.prev = cur
+        enabled = cur[1] - prev[1]
+        running = cur[2] - prev[2]
+        ratio = enabled / running if 0 < running < enabled else 1.0
+        deltas = [(cur[3 + i] - prev[3 + i]) * ratio * self.scales[i] for i in range(len(self.names))]
+        self.last_deltas = deltas
+        return deltas, enabled, running
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+
+class PerfEventCounters:
+    """In-process replacement for `perf stat -a -I` on core and uncore events.
+
+    Core events get one group per online CPU; each uncore PMU gets one
+    group per CPU in its cpumask (one per socket). read() returns the
+    summed per-interval delta of every event name, so the IMC cas_count
+    events of all channels arrive as one value each; the uncore deltas are
+    also kept per cpumask CPU in self.per_cpu for a per-socket split.
+
+    With cgroup_fd (an open cgroup directory) the core groups count only
+    while that cgroup's tasks run, still one group per online CPU.
+    """
+
+    def __init__(self, core_events=("instructions", "LLC-misses"), uncore_events=(),
+                 cgroup_fd=None, cpu_root=CPU_ROOT, pmu_root=PMU_ROOT):
+        # uncore_events: [(pmu, event, spec), ...]; spec None means the sysfs alias
+        self.groups = []
+        self.uncore_groups = []
+        self.units = {}
+        self.names = list(core_events)
+        try:
+            if core_events:
+                events = [(name,) + CORE_EVENTS[name] + (0, 0, 1.0) for name in core_events]
+                if cgroup_fd is not None:
+                    cpus = parse_cpu_list(read_sysfs(os.path.join(cpu_root, "online"), "0"))
+                    for cpu in cpus:
+                        self.groups.append(PerfGroup(events, cgroup_fd, cpu, open_flags=PERF_FLAG_PID_CGROUP))
+                else:
+                    cpus = parse_cpu_list(read_sysfs(os.path.join(cpu_root, "online"), "0"))
+                    for cpu in cpus:
+                        self.groups.append(PerfGroup(events, -1, cpu))
+
+            by_pmu = {}
+            for pmu, event, spec in uncore_events:
+                by_pmu.setdefault(pmu, []).append((event, spec))
+                if event not in self.names:
+                    self.names.append(event)
+            for pmu, pmu_events in by_pmu.items():
+                events = []
+                for event, spec in pmu_events:
+                    type_, config, config1, config2, scale, unit = encode_event(pmu, event, spec, pmu_root)
+                    events.append((event, type_, config, config1, config2, scale))
+                    self.units[event] = unit
+                cpumask = read_sysfs(os.path.join(pmu_root, pmu, "cpumask"), "0")
+                for cpu in parse_cpu_list(cpumask):
+                    group = PerfGroup(events, -1, cpu)
+                    self.groups.append(group)
+                    self.uncore_groups.append(group)
+        except OSError:
+            self.close()
+            raise
+        self.num_groups = len(self.groups)
+        self.per_cpu = {}
+        self.last_read_ns = 0
+        self.max_read_ns = 0
+        self.reads = 0
+
+    def start(self):
+        for group in self.groups:
+            group.enable()
+        return self
+
+    def read(self):
+        """Return ({event name: delta}, min running/enabled percent) for the last interval."""
+        t0 = time.perf_counter_ns()
+        totals = dict.fromkeys(self.names, 0.0)
+        min_running = 100.0
+        per_cpu = {}
+        for group in self.groups:
+            deltas, enabled, running = group.read_delta()
+            if enabled:
+                min_running = min(min_running, 100.0 * running / enabled)
+            for name, delta in zip(group.names, deltas):
+                totals[name] += delta
+        for group in self.uncore_groups:
+            for name, delta in zip(group.names, group.last_deltas):
+                key = (name, group.cpu)
+                per_cpu[key] = per_cpu.get(key, 0.0) + delta
+        self.per_cpu = per_cpu
+        self.last_read_ns = time.perf_counter_ns() - t0
+        self.max_read_ns = max(self.max_read_ns, self.last_read_ns)
+        self.reads += 1
+        return totals, min_running
+
+    def summary(self):
+        return (f"{self.num_groups} perf groups, {self.reads} reads, "
+                f"last {self.last_read_ns / 1000:.1f} us, max {self.max_read_ns / 1000:.1f} us")
+
+    def close(self):
+        for group in self.groups:
+            group.close()
+        self.groups = []
+        self.uncore_groups = []
+
+
+def sample_until_exit(benchmark_pid, writer, interval, make_row):
+    """Write make_row(elapsed, dt) every interval until the benchmark exits.
+
+    make_row reads the counters itself; the caller opens and closes them.
+    """
+    watcher = ExitWatcher(benchmark_pid).start()
+    ticker = DeadlineTicker(interval)
+    writer.set_start(ticker.start)
+    prev = ticker.start
+    while not watcher.exited.is_set():
+        # returns early on benchmark exit; that iteration is the final sample
+        now, _ = ticker.wait(watcher.exited)
+        dt = max(now - prev, 1e-6)
+        prev = now
+        writer.writerow(make_row(now - ticker.start, dt))
@@ -0,0 +1,181 @@
+import signal
+import subprocess
+import time
+from collections import namedtuple
+
+from pid_watch import ExitWatcher
+
+# One counter line of `perf stat -x, -I <ms>`:
+#   time,[CPU<n>,|S<n>,<cpus>,]value,unit,event,[cgroup,]run_time,pct_running,metric,metric_unit
+PerfSample = namedtuple('PerfSample', ['ts', 'cpu', 'value', 'unit', 'event', 'run_time', 'pct_running',
+                                       'socket', 'cgroup'], defaults=[None, None])
+
+NOT_COUNTED = ('<not counted>', '<not supported>')
+BYTES_PER_CAS = 64
+MIB_TO_MB = 1.048576
+
+
+def parse_perf_line(line, cgroups=False):
+    """Parse one machine-readable perf stat line; None for comments and blanks.
+
+    value is None when perf reports the event as not counted/supported
+    or the count does not parse.
+    With -A (no aggregation) the CPU column is returned as an int, with
+    --per-socket the socket id is. With cgroups (a session using -G)
+    every line has a cgroup column, empty for system-wide events: events
+    counted under -G carry their cgroup name, the others have cgroup None.
+    """
+    parts = line.rstrip('\n').split(',')
+    if len(parts) < 4 or parts[0].startswith('#'):
+        return None
+    try:
+        ts = float(parts[0])
+    except ValueError:
+        return None
+    cpu = None
+    socket = None
+    rest = parts[1:]
+    if rest[0].startswith('CPU'):
+        cpu = int(rest[0][3:])
+        rest = rest[1:]
+    elif rest[0][:1] == 'S' and rest[0][1:].isdigit():
+        socket = int(rest[0][1:])
+        rest = rest[2:]  # S<n>,<number of CPUs aggregated>
+    if len(rest) < 3:
+        return None
+    value_str, unit, event = rest[0].strip(), rest[1], rest[2]
+    try:
+        value = None if value_str in NOT_COUNTED else float(value_str)
+    except ValueError:
+        value = None  # e.g. a localized or truncated count
+    cgroup = None
+    if cgroups and len(rest) > 3:
+        # consumed even when empty, or the run time would shift into its place
+        cgroup = rest[3] or None
+        rest = rest[:3] + rest[4:]
+    try:
+        run_time = int(rest[3]) if len(rest) > 3 and rest[3] else None
+        pct_running = float(rest[4]) if len(rest) > 4 and rest[4] else 100.0
+    except ValueError:
+        run_time, pct_running = None, 100.0
+    return PerfSample(ts, cpu, value, unit, event, run_time, pct_running, socket, cgroup)
+
+
+class IntervalGrouper:
+    """Incremental form of iter_perf_intervals for readers that get one line at a time."""
+
+    def __init__(self, cgroups=False):
+        self.cgroups = cgroups
+        self.current_ts = None
+        self.group = []
+
+    def feed(self, line):
+        """Add a line; return (ts, samples) when it starts a new interval, else None."""
+        sample = parse_perf_line(line, self.cgroups)
+        if sample is None:
+            return None
+        done = None
+        if self.current_ts is not None and sample.ts != self.current_ts:
+            done = (self.current_ts, self.group)
+            self.group = []
+        self.current_ts = sample.ts
+        self.group.append(sample)
+        return done
+
+    def flush(self):
+        """Return the last, still open interval (or None) at end of stream."""
+        done = (self.current_ts, self.group) if self.group else None
+        self.group = []
+        return done
+
+
+def iter_perf_intervals(lines, cgroups=False):
+    """Group perf stat -I lines by perf's own interval timestamp.
+
+    Yields (ts, [PerfSample, ...]) once the next interval starts or the
+    stream ends, so missing or <not counted> events never stall the reader.
+    cgroups is passed on to parse_perf_line.
+    """
+    grouper = IntervalGrouper(cgroups)
+    for line in lines:
+        done = grouper.feed(line)
+        if done is not None:
+            yield done
+    done = grouper.flush()
+    if done is not None:
+        yield done
+
+
+def run_perf_stat(perf_cmd, benchmark_pid, writer, make_row, cgroups=False):
+    """Run a `perf stat -x, -I` child until the benchmark exits.
+
+    Every interval is written as make_row(ts, dt, samples), with ts perf's
+    own interval time. cgroups is passed on to parse_perf_line.
+    """
+    proc = subprocess.Popen(perf_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    # perf's interval timestamps count from about here
+    writer.set_start(time.monotonic())
+    watcher = ExitWatcher(benchmark_pid).start()
+    # SIGINT makes perf print the last (partial) interval and exit, so the
+    # loop below takes that final sample and then sees EOF
+    watcher.on_exit(lambda: proc.send_signal(signal.SIGINT))
+
+    prev_ts = 0.0
+    try:
+        for ts, samples in iter_perf_intervals(proc.stderr, cgroups):
+            dt = max(ts - prev_ts, 1e-6)
+            prev_ts = ts
+            writer.writerow(make_row(ts, dt, samples))
+    finally:
+        # clean up perf
+        try:
+            proc.send_signal(signal.SIGINT)
+            proc.wait(timeout=1)
+        except Exception:
+            proc.kill()
+
+
+def cas_to_mb(value, unit):
+    """IMC cas_count value -> MB; perf normally applies the 64 B/MiB scale itself."""
+    if unit == 'MiB':
+        return value * MIB_TO_MB
+    return value * BYTES_PER_CAS / 1_000_000
+
+
+class MultiplexSummary:
+    """Per-event (and per-cgroup) enabled/running statistics over a whole run.
+
+    perf scales every multiplexed count by enabled/running, so a value
+    from an interval where the event ran 25% of the time is a 4x
+    extrapolation; this keeps track of how much of a run that was.
+    """
+
+    def __init__(self):
+        # (event, cgroup) -> [intervals, multiplexed intervals, not counted, sum pct, min pct]
+        self.stats = {}
+
+    def add(self, sample):
+        # a -G session counts an event both for the cgroup and system-wide; keep them apart
+        s = self.stats.setdefault((sample.event, sample.cgroup), [0, 0, 0, 0.0, 100.0])
+        s[0] += 1
+        if sample.value is None:
+            s[2] += 1
+            return
+        if sample.pct_running < 100.0:
+            s[1] += 1
+        s[3] += sample.pct_running
+        s[4] = min(s[4], sample.pct_running)
+
+    def report(self):
+        lines = []
+        for (event, cgroup), (n, multiplexed, not_counted, total, low) in self.stats.items():
+            if cgroup is not None:
+                event = f"{event} [{cgroup}]"
+            counted = n - not_counted
+            if not counted:
+                lines.append(f"{event}: {n} intervals, never counted")
+                continue
+            mean = total / counted
+            lines.append(f"{event}: {n} intervals, {multiplexed} multiplexed, {not_counted} not counted, "
+                         f"running mean {mean:.1f}% min {low:.1f}%")
+        return "\n".join(lines)
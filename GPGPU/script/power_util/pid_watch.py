@@ -0,0 +1,125 @@
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+# Linux proc connector (linux/connector.h, linux/cn_proc.h)
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_EVENT_EXIT = 0x80000000
+
+PROC_POLL_INTERVAL = 0.05   # seconds, last-resort /proc polling
+
+
+def pid_running(pid):
+    """True while pid exists and is not a zombie."""
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return False
+    # state is the first field after the parenthesised comm
+    return stat[stat.rfind(b')') + 2:stat.rfind(b')') + 3] != b'Z'
+
+
+class ExitWatcher:
+    """Event-driven notification that the benchmark process has exited.
+
+    A daemon thread blocks on a pidfd (os.pidfd_open + poll), falling back to
+    the netlink proc connector and then to /proc polling. On exit it stamps
+    `end_time` (time.monotonic) and sets `exited`, so samplers sleeping in
+    `exited.wait()` wake immediately, and runs any `on_exit` callbacks, e.g.
+    to stop a perf child so its reader gets EOF.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.exited = threading.Event()
+        self.end_time = None
+        self.method = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"exit-watch-{self.pid}", daemon=True).start()
+        return self
+
+    def on_exit(self, callback):
+        with self.lock:
+            if not self.exited.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout=None):
+        """Sleep up to timeout seconds; return True as soon as the process has exited."""
+        return self.exited.wait(timeout)
+
+    def is_alive(self):
+        return not self.exited.is_set()
+
+    def _run(self):
+        for method in (self._wait_pidfd, self._wait_netlink, self._wait_proc):
+            try:
+                method()
+                self.method = method.__name__[len('_wait_'):]
+                break
+            except (OSError, AttributeError):
+                continue
+        self._fire()
+
+    def _fire(self):
+        with self.lock:
+            self.end_time = time.monotonic()
+            self.exited.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"pid_watch: exit callback failed: {e}")
+
+    def _wait_pidfd(self):
+        try:
+            fd = os.pidfd_open(self.pid)
+        except ProcessLookupError:
+            return
+        try:
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+            # pidfd becomes readable when the process terminates
+            while not poller.poll():
+                pass
+        finally:
+            os.close(fd)
+
+    def _wait_netlink(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            sock.bind((0, CN_IDX_PROC))
+            op = struct.pack('=I', PROC_CN_MCAST_LISTEN)
+            cn_msg = struct.pack('=IIIIHH', CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(op), 0) + op
+            sock.send(struct.pack('=IHHII', 16 + len(cn_msg), NLMSG_DONE, 0, 0, 0) + cn_msg)
+            # The process may have exited before we subscribed
+            if not pid_running(self.pid):
+                return
+            while True:
+                data = sock.recv(4096)
+                # nlmsghdr (16) + cn_msg (20) + proc_event header (16)
+                what, = struct.unpack_from('=I', data, 36)
+                if what != PROC_EVENT_EXIT:
+                    continue
+                process_pid, process_tgid = struct.unpack_from('=II', data, 52)
+                if process_tgid == self.pid and process_pid == self.pid:
+                    return
+        finally:
+            sock.close()
+
+    def _wait_proc(self):
+        while pid_running(self.pid):
+            time.sleep(PROC_POLL_INTERVAL)
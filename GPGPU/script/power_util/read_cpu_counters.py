@@ -0,0 +1,146 @@
+import argparse
+
+from cgroup_scope import BenchmarkCgroup
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from perf_event import PerfEventCounters, sample_until_exit
+from perf_stat import MultiplexSummary, run_perf_stat
+from read_cpu_metrics import throughput_header, throughput_row
+from uncore_pmu import SocketTraffic, UncorePmus
+
+# First four columns as in the existing cpu_metrics.csv files; bandwidth detail follows
+CPU_METRICS_HEADER = ["Time (s)", "IPS", "Memory Throughput (MB/s)", "LLC Misses"]
+# With --scope cgroup, IPS/LLC Misses cover only the benchmark and these keep the whole node
+SYSTEM_HEADER = ["System IPS", "System LLC Misses"]
+CORE_EVENTS = ("instructions", "LLC-misses")
+
+
+def cpu_metrics_header(uncore, scoped=False):
+    return CPU_METRICS_HEADER + (SYSTEM_HEADER if scoped else []) + throughput_header(uncore)[2:]
+
+
+def cpu_metrics_row(uncore, elapsed, dt, core, traffic, system=None):
+    bandwidth = throughput_row(uncore, elapsed, dt, traffic)
+    row = [elapsed, core["instructions"] / dt, bandwidth[1], core["LLC-misses"] / dt]
+    if system is not None:
+        row += [system["instructions"] / dt, system["LLC-misses"] / dt]
+    return row + bandwidth[2:]
+
+
+def cpu_counters_perf_cmd(uncore, interval, cgroup=None):
+    """perf stat command for monitor_cpu_counters.
+
+    --per-socket makes perf aggregate the core events and the uncore
+    cpumask CPUs per package, so every interval is a handful of lines that
+    all share perf's own timestamp. With a cgroup the core events are
+    counted twice: once under -G for the benchmark, once system-wide, and
+    every output line gets a cgroup column (parse with cgroups=True).
+    """
+    perf_cmd = ["perf", "stat", "-a", "--per-socket", "-x", ",", "-I", str(int(interval * 1000))]
+    if cgroup is not None:
+        # -G names map one-to-one onto the events given before it
+        for e in CORE_EVENTS:
+            perf_cmd += ["-e", e]
+        perf_cmd += ["-G", ",".join([cgroup.name] * len(CORE_EVENTS))]
+    for e in list(CORE_EVENTS) + uncore.events():
+        perf_cmd += ["-e", e]
+    return perf_cmd
+
+
+def perf_interval_row(uncore, elapsed, dt, samples, scoped=False, multiplex=None):
+    """cpu_metrics row for one perf stat interval."""
+    core = dict.fromkeys(CORE_EVENTS, 0.0)
+    system = dict.fromkeys(CORE_EVENTS, 0.0)
+    traffic = SocketTraffic(uncore)
+    counted = 0
+    min_running = 100.0
+    for sample in samples:
+        if multiplex is not None:
+            multiplex.add(sample)
+        if sample.value is None:
+            continue  # <not counted>: leave it out instead of waiting for it
+        counted += 1
+        # perf already scales multiplexed counts by enabled/running
+        min_running = min(min_running, sample.pct_running)
+        if sample.event in core:
+            if sample.cgroup is not None or not scoped:
+                core[sample.event] += sample.value
+            if sample.cgroup is None:
+                system[sample.event] += sample.value
+        else:
+            socket = sample.socket if sample.socket is not None else uncore.socket_of(None)
+            traffic.add(socket, sample.event, sample.value, sample.unit)
+    return (cpu_metrics_row(uncore, elapsed, dt, core, traffic, system if scoped else None)
+            + [counted, min_running])
+
+
+def monitor_cpu_counters(benchmark_pid, writer, uncore, interval=0.5, cgroup=None):
+    """IPS, LLC misses and IMC/UPI bandwidth from one perf stat session."""
+    perf_cmd = cpu_counters_perf_cmd(uncore, interval, cgroup)
+    scoped = cgroup is not None
+    multiplex = MultiplexSummary()
+    try:
+        run_perf_stat(perf_cmd, benchmark_pid, writer,
+                      lambda ts, dt, samples: perf_interval_row(uncore, ts, dt, samples, scoped, multiplex),
+                      cgroups=scoped)
+    finally:
+        print(f"read_cpu_counters: multiplexing summary\n{multiplex.report()}")
+
+
+def monitor_cpu_counters_perf_event(benchmark_pid, writer, uncore, interval=0.5, cgroup=None):
+    """Same output as monitor_cpu_counters, read in-process with perf_event_open."""
+    counters = PerfEventCounters(core_events=CORE_EVENTS, uncore_events=uncore.perf_event_list()).start()
+    scoped = None
+    if cgroup is not None:
+        scoped = PerfEventCounters(core_events=CORE_EVENTS, cgroup_fd=cgroup.open_fd()).start()
+
+    def make_row(elapsed, dt):
+        values, min_running = counters.read()
+        system = None
+        if scoped is not None:
+            system = values
+            values, scoped_running = scoped.read()
+            min_running = min(min_running, scoped_running)
+        traffic = SocketTraffic.from_counters(uncore, counters)
+        return cpu_metrics_row(uncore, elapsed, dt, values, traffic, system) + [len(counters.names), min_running]
+
+    try:
+        sample_until_exit(benchmark_pid, writer, interval, make_row)
+    finally:
+        print(f"read_cpu_counters: {counters.summary()}")
+        counters.close()
+        if scoped is not None:
+            scoped.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect IPS, LLC misses and memory bandwidth in one counter session.")
+    parser.add_argument("--pid", type=int, required=True, help="PID of the benchmark process")
+    parser.add_argument("--output_csv", type=str, required=True, help="Output CSV file path")
+    parser.add_argument("--interval", type=float, default=0.5, help="Sampling interval in seconds")
+    parser.add_argument("--backend", choices=["perf", "perf_event"], default="perf",
+                        help="perf: parse a perf stat child; perf_event: read the counters in-process")
+    parser.add_argument("--scope", choices=["system", "cgroup"], default="system",
+                        help="cgroup: count IPS/LLC misses for the benchmark's process tree only, "
+                             "keeping the system-wide values in separate columns")
+    parser.add_argument("--fsync_interval", type=float, default=FSYNC_INTERVAL, help="Seconds between fsyncs of the output CSV")
+    args = parser.parse_args()
+
+    uncore = UncorePmus()
+    print(f"read_cpu_counters: {uncore.summary()}")
+
+    cgroup = None
+    if args.scope == "cgroup":
+        cgroup = BenchmarkCgroup(f"power_monitor_{args.pid}")
+        print(f"read_cpu_counters: moved {cgroup.attach_tree(args.pid)} processes into {cgroup.path}")
+
+    exit_on_sigterm()
+    header = cpu_metrics_header(uncore, scoped=cgroup is not None)
+    try:
+        with StreamingCsvWriter(args.output_csv, header, fsync_interval=args.fsync_interval) as writer:
+            if args.backend == "perf_event":
+                monitor_cpu_counters_perf_event(args.pid, writer, uncore, args.interval, cgroup)
+            else:
+                monitor_cpu_counters(args.pid, writer, uncore, args.interval, cgroup)
+    finally:
+        if cgroup is not None:
+            cgroup.remove()
@@ -1,145 +1,142 @@
-import time
-import csv
 import argparse
 import psutil
-import subprocess
-import re
-import os
-import signal
-
-def monitor_imc_throughput(benchmark_pid, interval=1.0):
-    events = []
-    for i in range(8):  # adjust if your platform has a different count of IMC units
-        events += [
-            f"uncore_imc_{i}/cas_count_read/",
-            f"uncore_imc_{i}/cas_count_write/",
-        ]
-
-    perf_cmd = ["perf", "stat", "-I", str(int(interval * 1000))]
-    for e in events:
+
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from perf_event import PerfEventCounters, sample_until_exit
+from perf_stat import run_perf_stat
+from pid_watch import ExitWatcher
+from resctrl_mbm import MbmGroup
+from sampling import DeadlineTicker
+from uncore_pmu import SocketTraffic, UncorePmus
+
+THROUGHPUT_HEADER = ["Time (s)", "Memory Throughput (MB/s)", "Read (MB/s)", "Write (MB/s)"]
+COUNTER_HEADER = ["Counted Events", "Min Running (%)"]
+MBM_HEADER = ["Time (s)", "Memory Throughput (MB/s)", "Local (MB/s)", "Remote (MB/s)", "Attached Tasks"]
+
+
+def throughput_header(uncore):
+    per_socket = []
+    for socket in uncore.sockets:
+        per_socket += [f"S{socket} Read (MB/s)", f"S{socket} Write (MB/s)"]
+        if uncore.pmus["upi"]:
+            per_socket.append(f"S{socket} UPI Tx (MB/s)")
+    return THROUGHPUT_HEADER + per_socket + COUNTER_HEADER
+
+
+def throughput_row(uncore, elapsed, dt, traffic):
+    """Row for throughput_header() from the SocketTraffic moved during dt seconds."""
+    total_read = sum(traffic.read_mb.values())
+    total_write = sum(traffic.write_mb.values())
+    row = [elapsed, (total_read + total_write) / dt, total_read / dt, total_write / dt]
+    for socket in uncore.sockets:
+        row += [traffic.read_mb[socket] / dt, traffic.write_mb[socket] / dt]
+        if uncore.pmus["upi"]:
+            row.append(traffic.upi_mb[socket] / dt)
+    return row
+
+
+def monitor_imc_throughput(benchmark_pid, writer, uncore, interval=1.0):
+    if not uncore.pmus["imc"]:
+        raise RuntimeError("No uncore_imc PMUs with cas_count events found")
+
+    # -x, gives one self-describing line per event, stamped with perf's own interval time;
+    # -A keeps one line per cpumask CPU (one per socket) instead of summing the sockets
+    perf_cmd = ["perf", "stat", "-a", "-A", "-x", ",", "-I", str(int(interval * 1000))]
+    for e in uncore.events():
         perf_cmd += ["-e", e]
 
-    proc = subprocess.Popen(perf_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    start_time = time.time()
-    data = []
+    def make_row(ts, dt, samples):
+        traffic = SocketTraffic(uncore)
+        counted = 0
+        min_running = 100.0
+        for sample in samples:
+            if sample.value is None:
+                continue  # <not counted>: leave it out instead of waiting for it
+            counted += 1
+            # perf already scales multiplexed counts by enabled/running
+            min_running = min(min_running, sample.pct_running)
+            traffic.add(uncore.socket_of(sample.cpu), sample.event, sample.value, sample.unit)
+        return throughput_row(uncore, ts, dt, traffic) + [counted, min_running]
 
-    try:
-        while psutil.pid_exists(benchmark_pid):
-            # perf prints to stderr with one line per event each interval
-            # we collect one interval worth of lines
-            elapsed_time = time.time() - start_time
-            total_reads_mib = 0.0
-            total_writes_mib = 0.0
-            lines_this_interval = 0
-            expected_lines = len(events)
-
-            while lines_this_interval < expected_lines:
-                line = proc.stderr.readline()
-                if not line:
-                    break
-                m = re.search(r"([\d\.]+)\s+MiB\s+uncore_imc_(\d+)/cas_count_(read|write)/", line)
-                if m:
-                    val = float(m.group(1))
-                    kind = m.group(3)
-                    if kind == "read":
-                        total_reads_mib += val
-                    else:
-                        total_writes_mib += val
-                    lines_this_interval += 1
-
-            total_mib = total_reads_mib + total_writes_mib
-            total_mb = total_mib * 1.04858  # MiB to MB
-            data.append([elapsed_time, total_mb])
-            time.sleep(0.01)
-    finally:
-        # clean up perf
-        try:
-            proc.send_signal(signal.SIGINT)
-            proc.wait(timeout=1)
-        except Exception:
-            proc.kill()
+    run_perf_stat(perf_cmd, benchmark_pid, writer, make_row)
 
-    return data
 
+def monitor_imc_perf_event(benchmark_pid, writer, uncore, interval=1.0):
+    """Same output as monitor_imc_throughput, read in-process with perf_event_open."""
+    if not uncore.pmus["imc"]:
+        raise RuntimeError("No uncore_imc PMUs with cas_count events found")
 
+    counters = PerfEventCounters(core_events=(), uncore_events=uncore.perf_event_list()).start()
 
+    def make_row(elapsed, dt):
+        _, min_running = counters.read()
+        traffic = SocketTraffic.from_counters(uncore, counters)
+        return throughput_row(uncore, elapsed, dt, traffic) + [len(counters.per_cpu), min_running]
 
+    try:
+        sample_until_exit(benchmark_pid, writer, interval, make_row)
+    finally:
+        print(f"read_cpu_metrics: {counters.summary()}")
+        counters.close()
 
-def monitor_mbm(pid, interval=1.0, mg="g1", verbose=False):
-    base = "/sys/fs/resctrl"
-    mon_path = f"{base}/mon_groups/{mg}/mon_data"
 
-    # collect all mon_L3_xx paths
-    l3_paths = []
-    if not os.path.exists(mon_path):
-        raise RuntimeError(f"MBM path missing: {mon_path}")
-    for entry in os.listdir(mon_path):
-        fpath = os.path.join(mon_path, entry, "mbm_total_bytes")
-        if os.path.isfile(fpath):
-            l3_paths.append(fpath)
-    if not l3_paths:
-        raise RuntimeError(f"No mbm_total_bytes files under {mon_path}")
+def monitor_mbm(pid, writer, interval=1.0, verbose=False):
+    """Per-workload memory bandwidth from resctrl MBM, no uncore perf needed.
 
+    A monitoring group is created for this run, the benchmark's process
+    tree is attached to it (re-checked every tick for new processes) and
+    the group is removed when the benchmark exits.
+    """
     if not psutil.pid_exists(pid):
         raise RuntimeError(f"PID {pid} not found")
+    group = MbmGroup(pid)
+    watcher = ExitWatcher(pid).start()
+    ticker = DeadlineTicker(interval)
+    writer.set_start(ticker.start)
+    try:
+        prev = group.read()
+        last = ticker.start
+        while not watcher.exited.is_set():
+            # returns early on benchmark exit; that iteration is the final sample
+            now, _ = ticker.wait(watcher.exited)
+            group.refresh()
+            cur = group.read()
+            dt = max(now - last, 1e-6)
+            total = max(cur["mbm_total_bytes"] - prev["mbm_total_bytes"], 0) / 1_000_000 / dt
+            local = max(cur["mbm_local_bytes"] - prev["mbm_local_bytes"], 0) / 1_000_000 / dt
+            elapsed = now - ticker.start
+
+            writer.writerow([elapsed, total, local, max(total - local, 0.0), len(group.attached)])
+            if verbose:
+                print(f"[{elapsed:6.1f}s] {total:.1f} MB/s")
+            prev, last = cur, now
+    finally:
+        print(f"read_cpu_metrics: MBM group {group.path}, {len(group.attached)} tasks attached, "
+              f"{group.unavailable} unavailable reads")
+        group.remove()
 
-    def read_total_bytes():
-        total = 0
-        for f in l3_paths:
-            with open(f) as fh:
-                total += int(fh.read().strip())
-        return total
-
-    samples = []
-    start = last = time.time()
-    prev = read_total_bytes()
-
-    while True:
-        if not psutil.pid_exists(pid):
-            break
-
-        now = time.time()
-        sleep_time = interval - (now - last)
-        if sleep_time > 0:
-            time.sleep(sleep_time)
-        cur = time.time()
-
-        cur_total = read_total_bytes()
-        dt = max(cur - last, 1e-6)
-        delta = max(cur_total - prev, 0)
-
-        mbps = delta / (1024 * 1024) / dt
-        elapsed = cur - start
-
-        samples.append((elapsed, mbps))   # return tuple
-        if verbose:
-            print(f"[{elapsed:6.1f}s] {mbps:.1f} MB/s")
-
-        prev, last = cur_total, cur
-    # print(samples)
-    return samples
-
-
-
-
-
-
-def write_throughput_csv(output_csv, throughput_data):
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-    with open(output_csv, "w", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["Time (s)", "Memory Throughput (MB/s)"])
-        for t, mb in throughput_data:
-            w.writerow([t, mb])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Collect IMC memory throughput only.")
     parser.add_argument("--pid", type=int, required=True, help="PID of the benchmark process")
     parser.add_argument("--output_csv", type=str, required=True, help="Output CSV file path")
     parser.add_argument("--interval", type=float, default=1.0, help="Sampling interval in seconds")
+    parser.add_argument("--backend", choices=["perf", "perf_event", "resctrl"], default="perf",
+                        help="perf: parse a perf stat child; perf_event: read the counters in-process; "
+                             "resctrl: per-workload MBM bandwidth through a per-run resctrl group")
+    parser.add_argument("--fsync_interval", type=float, default=FSYNC_INTERVAL, help="Seconds between fsyncs of the output CSV")
     args = parser.parse_args()
 
-    throughput = monitor_imc_throughput(args.pid, args.interval)
-    # throughput = monitor_mbm(args.pid, args.interval)
-    write_throughput_csv(args.output_csv, throughput)
+    exit_on_sigterm()
+    if args.backend == "resctrl":
+        with StreamingCsvWriter(args.output_csv, MBM_HEADER, fsync_interval=args.fsync_interval) as writer:
+            monitor_mbm(args.pid, writer, args.interval)
+    else:
+        uncore = UncorePmus()
+        print(f"read_cpu_metrics: {uncore.summary()}")
+        with StreamingCsvWriter(args.output_csv, throughput_header(uncore), fsync_interval=args.fsync_interval) as writer:
+            if args.backend == "perf_event":
+                monitor_imc_perf_event(args.pid, writer, uncore, args.interval)
+            else:
+                monitor_imc_throughput(args.pid, writer, uncore, args.interval)
 
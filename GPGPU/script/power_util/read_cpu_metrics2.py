@@ -1,86 +1,159 @@
-import time
-import csv
 import argparse
-import psutil
-import subprocess
 import os
+import sys
+
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from event_groups import describe_plan, event_name, perf_group_args, plan_event_groups, split_events
+from perf_event import PerfEventCounters, sample_until_exit
+from perf_stat import MultiplexSummary, run_perf_stat
+
+DEFAULT_EVENTS = ["instructions", "LLC-misses"]
+# CSV column per event; other events are reported as '<event name> (/s)'
+EVENT_COLUMNS = {"instructions": "IPS", "LLC-misses": "LLC Misses"}
+
+# Named event sets, as Intel perfmon event names resolved for the running CPU
+# through tools/pcm/scripts/pmu_query.py. Each slot lists alternatives across
+# generations (Skylake-SP first, then Ice Lake/Sapphire Rapids); the first
+# one the CPU has on a general-purpose counter is used and missing slots
+# are skipped.
+EVENT_PRESETS = {
+    "topdown-l1": [
+        ["CPU_CLK_UNHALTED.THREAD_P", "CPU_CLK_UNHALTED.THREAD"],
+        ["IDQ_UOPS_NOT_DELIVERED.CORE"],
+        ["UOPS_ISSUED.ANY"],
+        ["UOPS_RETIRED.RETIRE_SLOTS", "UOPS_RETIRED.SLOTS"],
+        ["INT_MISC.RECOVERY_CYCLES_ANY", "INT_MISC.RECOVERY_CYCLES", "INT_MISC.CLEARS_COUNT"],
+    ],
+    "memory-stalls": [
+        ["CYCLE_ACTIVITY.STALLS_TOTAL"],
+        ["CYCLE_ACTIVITY.STALLS_MEM_ANY"],
+        ["CYCLE_ACTIVITY.STALLS_L1D_MISS"],
+        ["CYCLE_ACTIVITY.STALLS_L2_MISS"],
+        ["CYCLE_ACTIVITY.STALLS_L3_MISS"],
+        ["EXE_ACTIVITY.BOUND_ON_STORES"],
+    ],
+    "fp-ops": [
+        ["FP_ARITH_INST_RETIRED.SCALAR_DOUBLE"],
+        ["FP_ARITH_INST_RETIRED.SCALAR_SINGLE"],
+        ["FP_ARITH_INST_RETIRED.128B_PACKED_DOUBLE"],
+        ["FP_ARITH_INST_RETIRED.128B_PACKED_SINGLE"],
+        ["FP_ARITH_INST_RETIRED.256B_PACKED_DOUBLE"],
+        ["FP_ARITH_INST_RETIRED.256B_PACKED_SINGLE"],
+        ["FP_ARITH_INST_RETIRED.512B_PACKED_DOUBLE"],
+        ["FP_ARITH_INST_RETIRED.512B_PACKED_SINGLE"],
+    ],
+}
+PMU_QUERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "tools", "pcm", "scripts")
+
+
+def resolve_preset(preset, event_files=None):
+    """perf raw event strings for a preset on this CPU (or from perfmon JSON event_files)."""
+    if PMU_QUERY_DIR not in sys.path:
+        sys.path.insert(0, PMU_QUERY_DIR)
+    import pmu_query
+
+    database = pmu_query.load_events(files=event_files)
+    specs = []
+    for alternatives in EVENT_PRESETS[preset]:
+        for name in alternatives:
+            event = pmu_query.find_event(database, name)
+            # fixed-counter pseudo-events (EventCode 0x00) do not count on a general-purpose counter
+            if event is not None and "fixed" not in event.get("Counter", "").lower():
+                specs.append(pmu_query.perf_encodings(event)[0])
+                break
+        else:
+            print(f"read_cpu_metrics2: {preset}: none of {alternatives} on this CPU, skipped")
+    return specs
+
+
+def event_column(event):
+    name = event_name(event)
+    return EVENT_COLUMNS.get(name, f"{name} (/s)")
+
+
+def ips_llc_header(events=DEFAULT_EVENTS):
+    names = [event_name(e) for e in events]
+    return (["Time (s)"] + [event_column(e) for e in events]
+            + [f"{EVENT_COLUMNS.get(n, n)} Running (%)" for n in names])
+
+
+IPS_LLC_HEADER = ips_llc_header()
+
 
 # Single perf stream for both instructions and LLC misses
-def monitor_ips_and_llc(benchmark_pid, ips_data, llc_data, interval=0.5):
-    # perf stat CSV columns with -x , and -I are: time,value,unit,event,run,cpus
-    perf_cmd = [
-        "perf", "stat",
-        "-I", str(int(interval * 1000)),
-        "-x", ",",
-        "-a",
-        "-e", "instructions",
-        "-e", "LLC-misses",
-        "sleep", "infinity",
-    ]
-    proc = subprocess.Popen(perf_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    start_time = time.time()
+def monitor_ips_and_llc(benchmark_pid, writer, interval=0.5, events=DEFAULT_EVENTS, gp_counters=None):
+    # events are packed into as few perf groups as the counters allow; more
+    # than one core group means the kernel time-slices (multiplexes) them
+    groups = plan_event_groups(events, gp_counters)
+    print(f"read_cpu_metrics2: {describe_plan(groups)}")
+    perf_cmd = ["perf", "stat", "-I", str(int(interval * 1000)), "-x", ",", "-a"]
+    perf_cmd += perf_group_args(groups) + ["sleep", "infinity"]
+
+    multiplex = MultiplexSummary()
+    names = [event_name(e) for e in events]
+
+    def make_row(ts, dt, samples):
+        values = dict.fromkeys(names, 0.0)
+        running = dict.fromkeys(names, 0.0)
+        for sample in samples:
+            multiplex.add(sample)
+            if sample.event not in values or sample.value is None:
+                continue
+            # perf has already scaled the count by enabled/running
+            values[sample.event] = sample.value
+            running[sample.event] = sample.pct_running
+        return [ts] + [values[n] / dt for n in names] + [running[n] for n in names]
+
     try:
-        while psutil.pid_exists(benchmark_pid):
-            elapsed_time = time.time() - start_time
-            inst = None
-            llc = None
-
-            # read exactly two lines per interval
-            got = 0
-            while got < 2:
-                line = proc.stderr.readline()
-                if not line:
-                    break
-                parts = line.strip().split(",")
-                if len(parts) < 4 or parts[0].startswith("#"):
-                    continue
-                # parts[1] is value, parts[2] is unit, parts[3] is event name
-                val_str = parts[1].replace(" ", "")
-                event = parts[3]
-                try:
-                    val = float(val_str)
-                except ValueError:
-                    val = 0.0
-                if event == "instructions":
-                    inst = val
-                    got += 1
-                elif event == "LLC-misses":
-                    llc = val
-                    got += 1
-
-            ips = (inst or 0.0) / interval          # per second
-            llc_rate = (llc or 0.0) / interval      # per second
-
-            ips_data.append([elapsed_time, ips])
-            llc_data.append([elapsed_time, llc_rate])
-
-            time.sleep(0.01)
+        run_perf_stat(perf_cmd, benchmark_pid, writer, make_row)
     finally:
-        try:
-            proc.terminate()
-        except Exception:
-            pass
-
-def write_ips_llc_csv(output_csv, ips_data, llc_data):
-    # align by shortest length
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-    n = min(len(ips_data), len(llc_data))
-    with open(output_csv, "w", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["Time (s)", "IPS", "LLC Misses"])
-        for i in range(n):
-            w.writerow([ips_data[i][0], ips_data[i][1], llc_data[i][1]])
+        print(f"read_cpu_metrics2: multiplexing summary\n{multiplex.report()}")
+
+
+def monitor_ips_and_llc_perf_event(benchmark_pid, writer, interval=0.5):
+    """Same output as monitor_ips_and_llc, read in-process with perf_event_open
+    (one instructions+LLC-misses group per CPU) instead of a perf child."""
+    counters = PerfEventCounters(core_events=("instructions", "LLC-misses")).start()
+
+    def make_row(elapsed, dt):
+        values, min_running = counters.read()
+        return [elapsed, values["instructions"] / dt, values["LLC-misses"] / dt, min_running, min_running]
+
+    try:
+        sample_until_exit(benchmark_pid, writer, interval, make_row)
+    finally:
+        print(f"read_cpu_metrics2: {counters.summary()}")
+        counters.close()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Collect instructions and LLC misses with one perf stat stream")
     parser.add_argument("--pid", type=int, required=True, help="PID of the benchmark process")
     parser.add_argument("--output_csv", type=str, required=True, help="Output CSV file path")
     parser.add_argument("--interval", type=float, default=0.5, help="Sampling interval in seconds")
+    parser.add_argument("--events", type=str, default=",".join(DEFAULT_EVENTS),
+                        help="Comma-separated core events for the perf backend")
+    parser.add_argument("--preset", choices=sorted(EVENT_PRESETS), action="append", default=[],
+                        help="Add a named event set (resolved for this CPU from Intel perfmon data); repeatable")
+    parser.add_argument("--event_file", type=str, default=None,
+                        help="Comma-separated perfmon JSON file(s) to resolve presets offline (see pmu-query.py -d)")
+    parser.add_argument("--gp_counters", type=int, default=None,
+                        help="General-purpose counters per CPU for group planning (default: from the core PMU; 4 with SMT, 8 without on older parts)")
+    parser.add_argument("--backend", choices=["perf", "perf_event"], default="perf",
+                        help="perf: parse a perf stat child; perf_event: read the counters in-process")
+    parser.add_argument("--fsync_interval", type=float, default=FSYNC_INTERVAL, help="Seconds between fsyncs of the output CSV")
     args = parser.parse_args()
 
-    ips_data = []
-    llc_data = []
+    events = split_events(args.events)
+    event_files = args.event_file.split(",") if args.event_file else None
+    for preset in args.preset:
+        events += [e for e in resolve_preset(preset, event_files) if e not in events]
+    if args.backend == "perf_event" and events != DEFAULT_EVENTS:
+        parser.error("--events is only supported by the perf backend")
 
-    # no extra threads needed
-    monitor_ips_and_llc(args.pid, ips_data, llc_data, args.interval)
-    write_ips_llc_csv(args.output_csv, ips_data, llc_data)
+    exit_on_sigterm()
+    with StreamingCsvWriter(args.output_csv, ips_llc_header(events), fsync_interval=args.fsync_interval) as writer:
+        if args.backend == "perf_event":
+            monitor_ips_and_llc_perf_event(args.pid, writer, args.interval)
+        else:
+            monitor_ips_and_llc(args.pid, writer, args.interval, events, args.gp_counters)
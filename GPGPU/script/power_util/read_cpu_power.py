@@ -2,111 +2,418 @@ import time
 import os
 import csv
 import argparse
-import psutil
+import re
+
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from pid_watch import ExitWatcher
+from sampling import DeadlineTicker
 
 # Constants for RAPL energy files specific to your system
 RAPL_PATH = "/sys/class/powercap/"
 
-def discover_rapl_sockets():
-    """Discover CPU and DRAM energy files from RAPL."""
-    energy_files = {}
-    
-    # Check for CPU and DRAM energy files
-    for socket_id in range(2):  # Adjust if you have more sockets
-        cpu_energy_file = f"/sys/class/powercap/intel-rapl:{socket_id}/energy_uj"
-        dram_energy_file = f"/sys/class/powercap/intel-rapl:{socket_id}/intel-rapl:{socket_id}:0/energy_uj"
-        
-        if os.path.exists(cpu_energy_file):
-            energy_files[f'cpu_socket{socket_id}'] = cpu_energy_file
-            # print(f"Found CPU socket energy file: {cpu_energy_file}")
+# Top-level zones are intel-rapl:N (one per package, plus psys where the
+# platform exposes it); subzones intel-rapl:N:M hang below their package.
+# intel-rapl-mmio zones duplicate the package counters and are skipped.
+ZONE_RE = re.compile(r"intel-rapl(:\d+)+")
 
-        if os.path.exists(dram_energy_file):
-            energy_files[f'dram_socket{socket_id}'] = dram_energy_file
-            # print(f"Found DRAM socket energy file: {dram_energy_file}")
 
-    if not energy_files:
-        print("No energy files found. Check if RAPL is enabled on your system.")
-    
-    return energy_files
-
-# Initialize ENERGY_FILES with available sockets
-ENERGY_FILES = discover_rapl_sockets()
+def zone_sort_key(entry):
+    return [int(i) for i in entry.split(':')[1:]]
 
 
-def read_energy(file_path):
-    """Read the energy value from a given RAPL energy file."""
-    try:
-        with open(file_path, 'r') as f:
-            return int(f.read())
-    except FileNotFoundError:
-        print(f"File {file_path} not found.")
-        return 0
-    except PermissionError:
-        print(f"Permission denied when reading the file {file_path}.")
-        return 0
-    except Exception as e:
-        print(f"Error reading the file {file_path}: {e}")
-        return 0
-
-def monitor_power(benchmark_pid, output_csv, avg, interval=0.5):
-    """Monitor power consumption for CPU sockets and DRAM."""
-    start_time = time.time()
-    initial_values = {key: read_energy(path) for key, path in ENERGY_FILES.items()}
-    power_data = []
-    total_cpu_energy = 0
-    total_dram_energy = 0
+def discover_rapl_domains(root=RAPL_PATH):
+    """Walk the powercap tree and return {domain key: energy_uj path} for every RAPL zone.
 
-    while psutil.pid_exists(benchmark_pid):
-        time.sleep(interval)
-        current_time = time.time()
-        elapsed_time = current_time - start_time
-        current_values = {key: read_energy(path) for key, path in ENERGY_FILES.items()}
+    Keys are '<name>-<socket>' (package-0, core-0, uncore-0, dram-0, ...) or
+    just the zone name for platform-wide zones such as psys. Domain types come
+    from each zone's `name` file, never from the subzone index.
+    """
+    energy_files = {}
 
+    def walk(zone_dir, socket):
+        try:
+            with open(os.path.join(zone_dir, 'name'), 'r') as f:
+                name = f.read().strip()
+        except OSError:
+            return
+        if name.startswith('package-'):
+            socket = name[len('package-'):]
+            name = 'package'
+        key = name if socket is None else f'{name}-{socket}'
+        energy_file = os.path.join(zone_dir, 'energy_uj')
+        if os.path.exists(energy_file):
+            suffix = 1
+            unique_key = key
+            while unique_key in energy_files:
+                unique_key = f'{key}.{suffix}'
+                suffix += 1
+            energy_files[unique_key] = energy_file
+
+        prefix = os.path.basename(zone_dir) + ':'
+        children = [e for e in os.listdir(zone_dir) if e.startswith(prefix) and ZONE_RE.fullmatch(e)]
+        for child in sorted(children, key=zone_sort_key):
+            walk(os.path.join(zone_dir, child), socket)
 
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        entries = []
+    top_zones = [e for e in entries if ZONE_RE.fullmatch(e) and e.count(':') == 1]
+    for entry in sorted(top_zones, key=zone_sort_key):
+        walk(os.path.join(root, entry), None)
 
-        energy_consumed = {
-            key: (current_values[key] - initial_values[key]) / 1_000_000  # Convert to joules
-            for key in ENERGY_FILES
-        }
-        initial_values = current_values
+    if not energy_files:
+        print("No energy files found. Check if RAPL is enabled on your system.")
 
-        # Sum energy for CPU and DRAM sockets
-        cpu_energy = sum(energy_consumed[key] for key in energy_consumed if 'cpu_socket' in key)
-        dram_energy = sum(energy_consumed[key] for key in energy_consumed if 'dram_socket' in key)
+    return energy_files
 
-        
-        total_cpu_energy += cpu_energy
-        total_dram_energy += dram_energy
+# Initialize ENERGY_FILES with every RAPL domain on the node
+ENERGY_FILES = discover_rapl_domains()
 
-        # Convert energy to power (Watts)
-        cpu_power = cpu_energy / interval
-        dram_power = dram_energy / interval
+# Upper bound on the power a single RAPL domain can draw. Used only to decide
+# how long a counter needs at minimum to wrap, i.e. when a wrap count between
+# two reads becomes ambiguous.
+MAX_DOMAIN_POWER_W = 1000
 
-        power_data.append([elapsed_time, cpu_power, dram_power])
 
-    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+def read_max_energy_range(energy_file):
+    """Read max_energy_range_uj next to an energy_uj file (counter wraps at this value)."""
+    range_file = os.path.join(os.path.dirname(energy_file), 'max_energy_range_uj')
+    try:
+        with open(range_file, 'r') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        # 32-bit counter in the common 61 uJ unit, the usual sysfs value
+        return 2**32 * 61
+
+
+class EnergyCounter:
+    """Wrap-safe cumulative energy for one RAPL domain.
+
+    Raw energy_uj wraps at max_energy_range_uj. A negative delta between two
+    reads is taken as exactly one wrap; if the reads are so far apart that the
+    counter could have gone around more than once at MAX_DOMAIN_POWER_W, the
+    sample is flagged as suspect.
+    """
+
+    def __init__(self, max_range_uj, max_power_w=MAX_DOMAIN_POWER_W):
+        self.max_range = max_range_uj
+        self.min_wrap_s = max_range_uj / (max_power_w * 1_000_000)
+        self.prev = None
+        self.total = 0      # cumulative uJ since the first read (Python int, never overflows)
+        self.wraps = 0
+        self.suspect = 0
+
+    def update(self, raw, dt):
+        """Feed a raw reading taken dt seconds after the previous one; return (delta_uj, suspect)."""
+        if self.prev is None:
+            self.prev = raw
+            return 0, False
+        delta = raw - self.prev
+        if delta < 0:
+            delta += self.max_range
+            self.wraps += 1
+        self.prev = raw
+        self.total += delta
+        suspect = dt >= self.min_wrap_s
+        if suspect:
+            self.suspect += 1
+        return delta, suspect
+
+
+class RaplReader:
+    """Batch reader for RAPL energy_uj files.
+
+    Every file is opened once and re-read with os.preadv at offset 0 into a
+    preallocated buffer, so a tick costs one syscall per domain instead of
+    open/read/close. Read errors are counted rather than printed; a failed
+    domain repeats its last value (zero energy for that sample).
+    """
+
+    def __init__(self, energy_files):
+        self.keys = []
+        self.fds = []
+        self.max_ranges = {}
+        for key, path in energy_files.items():
+            try:
+                self.fds.append(os.open(path, os.O_RDONLY))
+                self.keys.append(key)
+                self.max_ranges[key] = read_max_energy_range(path)
+            except OSError as e:
+                print(f"Cannot open {path}: {e}")
+        self.buf = bytearray(32)
+        self.bufs = [self.buf]
+        self.last = [0] * len(self.fds)
+        self.errors = 0
+        self.batches = 0
+        self.last_read_ns = 0
+        self.total_read_ns = 0
+        self.max_read_ns = 0
+
+    def read_all(self):
+        """Read every domain once; return a list of raw uJ values in self.keys order."""
+        t0 = time.perf_counter_ns()
+        values = self.last
+        for i, fd in enumerate(self.fds):
+            try:
+                n = os.preadv(fd, self.bufs, 0)
+                values[i] = int(self.buf[:n])
+            except (OSError, ValueError):
+                self.errors += 1
+        elapsed = time.perf_counter_ns() - t0
+        self.batches += 1
+        self.last_read_ns = elapsed
+        self.total_read_ns += elapsed
+        if elapsed > self.max_read_ns:
+            self.max_read_ns = elapsed
+        return list(values)
+
+    def summary(self):
+        mean_us = self.total_read_ns / max(self.batches, 1) / 1000
+        return (f"{self.batches} batch reads of {len(self.keys)} domains, "
+                f"mean {mean_us:.1f} us, max {self.max_read_ns / 1000:.1f} us, {self.errors} errors")
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+# RAPL MSR addresses and unit fields, as in tools/RAPL/RaplPowerMonitor.c
+MSR_RAPL_POWER_UNIT = 0x606
+MSR_PKG_ENERGY_STATUS = 0x611
+MSR_PP0_ENERGY_STATUS = 0x639
+MSR_DRAM_ENERGY_STATUS = 0x619
+ENERGY_UNIT_OFFSET = 0x08
+ENERGY_UNIT_MASK = 0x1F00
+# Server parts report DRAM energy in a fixed 2^-16 J unit regardless of
+# MSR_RAPL_POWER_UNIT (the kernel's intel_rapl driver does the same); client
+# parts use the MSR unit, as tools/RAPL/RaplPowerMonitor.c does everywhere
+SERVER_DRAM_ENERGY_UNIT = 0.5 ** 16
+# Intel family 6 models with the fixed DRAM unit: Haswell-X, Broadwell-X/D,
+# Skylake/Cascade Lake-X, Xeon Phi KNL/KNM, Ice Lake-X/D, Sapphire/Emerald
+# Rapids, Granite Rapids-X/D
+SERVER_DRAM_MODELS = {0x3F, 0x4F, 0x56, 0x55, 0x57, 0x85, 0x6A, 0x6C, 0x8F, 0xCF, 0xAD, 0xAE}
+
+MSR_DOMAINS = {
+    'package': MSR_PKG_ENERGY_STATUS,
+    'core': MSR_PP0_ENERGY_STATUS,
+    'dram': MSR_DRAM_ENERGY_STATUS,
+}
+
+
+def server_dram_unit(cpuinfo="/proc/cpuinfo"):
+    """SERVER_DRAM_ENERGY_UNIT on the server models that need it, else None (use the MSR unit)."""
+    fields = {}
+    try:
+        with open(cpuinfo, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    break  # the first CPU is enough
+                key, _, value = line.partition(':')
+                fields[key.strip()] = value.strip()
+    except OSError:
+        return None
+    try:
+        family, model = int(fields.get('cpu family', '')), int(fields.get('model', ''))
+    except ValueError:
+        return None
+    if fields.get('vendor_id') == 'GenuineIntel' and family == 6 and model in SERVER_DRAM_MODELS:
+        return SERVER_DRAM_ENERGY_UNIT
+    return None
+
+
+def socket_representative_cpus():
+    """Return {socket id: first online CPU on that socket}."""
+    cpus = {}
+    base = "/sys/devices/system/cpu"
+    for entry in os.listdir(base):
+        if not re.fullmatch(r"cpu\d+", entry):
+            continue
+        try:
+            with open(os.path.join(base, entry, "topology/physical_package_id"), 'r') as f:
+                socket_id = int(f.read())
+        except OSError:
+            continue
+        cpu = int(entry[3:])
+        if socket_id not in cpus or cpu < cpus[socket_id]:
+            cpus[socket_id] = cpu
+    return dict(sorted(cpus.items()))
+
+
+class MsrReader:
+    """Batch reader for the RAPL energy-status MSRs through /dev/cpu/N/msr.
+
+    Same interface as RaplReader (keys, max_ranges, read_all, summary, close)
+    and returns uJ, so the rest of the monitor does not care which backend is
+    in use. Needs the msr module loaded and root. Bypasses the sysfs layer, so
+    1 ms sampling is practical.
+    """
+
+    def __init__(self, dram_unit=None):
+        # dram_unit in J; None picks it from the CPU model, 0 forces the MSR unit
+        if dram_unit is None:
+            dram_unit = server_dram_unit()
+        self.keys = []
+        self.fds = []
+        self.addrs = []
+        self.units_uj = []
+        self.max_ranges = {}
+        self.socket_fds = []
+        for socket_id, cpu in socket_representative_cpus().items():
+            path = f"/dev/cpu/{cpu}/msr"
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError as e:
+                print(f"Cannot open {path}: {e} (is the msr module loaded?)")
+                continue
+            self.socket_fds.append(fd)
+            # Units are decoded once at startup
+            units = int.from_bytes(os.pread(fd, 8, MSR_RAPL_POWER_UNIT), 'little')
+            energy_unit = 0.5 ** ((units & ENERGY_UNIT_MASK) >> ENERGY_UNIT_OFFSET)
+            for name, addr in MSR_DOMAINS.items():
+                try:
+                    os.pread(fd, 8, addr)
+                except OSError:
+                    continue  # domain not implemented on this SKU
+                unit = dram_unit if name == 'dram' and dram_unit else energy_unit
+                key = f'{name}-{socket_id}'
+                self.keys.append(key)
+                self.fds.append(fd)
+                self.addrs.append(addr)
+                self.units_uj.append(unit * 1_000_000)
+                # Energy status is a 32-bit counter
+                self.max_ranges[key] = 2**32 * unit * 1_000_000
+        self.last = [0] * len(self.fds)
+        self.errors = 0
+        self.batches = 0
+        self.last_read_ns = 0
+        self.total_read_ns = 0
+        self.max_read_ns = 0
+
+    def read_all(self):
+        """Read every domain once; return a list of uJ values in self.keys order."""
+        t0 = time.perf_counter_ns()
+        values = self.last
+        for i, fd in enumerate(self.fds):
+            try:
+                raw = int.from_bytes(os.pread(fd, 8, self.addrs[i]), 'little') & 0xFFFFFFFF
+                values[i] = raw * self.units_uj[i]
+            except OSError:
+                self.errors += 1
+        elapsed = time.perf_counter_ns() - t0
+        self.batches += 1
+        self.last_read_ns = elapsed
+        self.total_read_ns += elapsed
+        if elapsed > self.max_read_ns:
+            self.max_read_ns = elapsed
+        return list(values)
+
+    def summary(self):
+        mean_us = self.total_read_ns / max(self.batches, 1) / 1000
+        return (f"{self.batches} batch reads of {len(self.keys)} MSR domains, "
+                f"mean {mean_us:.1f} us, max {self.max_read_ns / 1000:.1f} us, {self.errors} errors")
+
+    def close(self):
+        for fd in self.socket_fds:
+            os.close(fd)
+        self.socket_fds = []
+        self.fds = []
+
+
+POWER_TRACE_HEADER = ['Time (s)', 'Package Power (W)', 'DRAM Power (W)', 'Sample dt (s)', 'Skipped Ticks',
+                      'Wrap Suspect', 'Read Latency (us)']
+
+
+def power_trace_header(keys):
+    return POWER_TRACE_HEADER + [f'{key} Power (W)' for key in keys]
+
+
+def monitor_power(benchmark_pid, output_csv, avg, interval=0.5, backend='sysfs', fsync_interval=FSYNC_INTERVAL):
+    """Monitor power consumption for CPU sockets and DRAM."""
+    reader = MsrReader() if backend == 'msr' else RaplReader(ENERGY_FILES)
+    ticker = DeadlineTicker(interval)
+    start_time = prev_time = ticker.start
+    counters = {key: EnergyCounter(reader.max_ranges[key]) for key in reader.keys}
+    for key, raw in zip(reader.keys, reader.read_all()):
+        counters[key].update(raw, 0)
+
+    trace = None
+    if not avg:
+        trace = StreamingCsvWriter(output_csv, power_trace_header(reader.keys), fsync_interval=fsync_interval)
+        trace.set_start(start_time)
+
+    watcher = ExitWatcher(benchmark_pid).start()
+    try:
+        while True:
+            # Sleep to an absolute deadline and use the measured dt, not the nominal interval.
+            # Benchmark exit cuts the sleep short and the loop ends after this final sample.
+            current_time, skipped = ticker.wait(watcher.exited)
+            current_values = reader.read_all()
+            elapsed_time = current_time - start_time
+            dt = max(current_time - prev_time, 1e-6)
+            prev_time = current_time
+
+            energy_consumed = {}
+            wrap_suspect = False
+            for key, raw in zip(reader.keys, current_values):
+                delta, suspect = counters[key].update(raw, dt)
+                energy_consumed[key] = delta / 1_000_000  # Convert to joules
+                wrap_suspect |= suspect
+
+            # Sum energy for CPU packages and DRAM; core/uncore are already inside package
+            cpu_energy = sum(energy_consumed[key] for key in energy_consumed if key.startswith('package-'))
+            dram_energy = sum(energy_consumed[key] for key in energy_consumed if key.startswith('dram-'))
+
+            # Convert energy to power (Watts)
+            cpu_power = cpu_energy / dt
+            dram_power = dram_energy / dt
+
+            if trace is not None:
+                read_latency_us = reader.last_read_ns / 1000
+                domain_power = [energy_consumed[key] / dt for key in reader.keys]
+                trace.writerow([elapsed_time, cpu_power, dram_power, dt, skipped, int(wrap_suspect), read_latency_us]
+                               + domain_power)
+            if watcher.exited.is_set():
+                break
+    finally:
+        reader.close()
+        if trace is not None:
+            trace.close()
+
+    print(f"read_cpu_power: benchmark exited at {watcher.end_time - start_time:.4f} s (via {watcher.method})")
+    print(f"read_cpu_power: {reader.summary()}")
+    if ticker.late_ticks:
+        print(f"read_cpu_power: {ticker.late_ticks} late ticks, {ticker.skipped_ticks} skipped ticks")
+    suspect_samples = sum(c.suspect for c in counters.values())
+    if suspect_samples:
+        print(f"read_cpu_power: {suspect_samples} samples may span more than one counter wrap")
 
     if avg:
+        # Totals come from the cumulative per-domain counters, so wraps never corrupt them
+        total_cpu_energy = sum(c.total for key, c in counters.items() if key.startswith('package-')) / 1_000_000
+        total_dram_energy = sum(c.total for key, c in counters.items() if key.startswith('dram-')) / 1_000_000
+
+        os.makedirs(os.path.dirname(output_csv), exist_ok=True)
         file_exists = os.path.isfile(output_csv)
         with open(output_csv, 'a', newline='') as file:
             writer = csv.writer(file)
             if not file_exists:
                 writer.writerow(['CPU_E (J)', 'DRAM_E (J)'])
             writer.writerow([round(total_cpu_energy, 2), round(total_dram_energy, 2)])
-    else:
-        with open(output_csv, 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['Time (s)', 'Package Power (W)', 'DRAM Power (W)'])
-            writer.writerows(power_data)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Monitor power usage using RAPL for all CPU sockets and DRAM.')
     parser.add_argument('--pid', type=int, required=True, help='PID of the benchmark process')
     parser.add_argument('--output_csv', type=str, required=True, help='Output CSV file path')
     parser.add_argument('--avg', type=int, default=0, help='Collect average energy (1 for True, 0 for False)')
+    parser.add_argument('--interval', type=float, default=0.5, help='Sampling interval in seconds')
+    parser.add_argument('--backend', type=str, default='sysfs', choices=['sysfs', 'msr'],
+                        help='Read RAPL through powercap sysfs or directly from the energy-status MSRs')
+    parser.add_argument('--fsync_interval', type=float, default=FSYNC_INTERVAL, help='Seconds between fsyncs of the output CSV')
     args = parser.parse_args()
 
-    monitor_power(args.pid, args.output_csv, args.avg)
+    exit_on_sigterm()
+    monitor_power(args.pid, args.output_csv, args.avg, args.interval, args.backend, args.fsync_interval)
 
 
 # import time
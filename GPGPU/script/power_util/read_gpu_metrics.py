@@ -1,233 +1,286 @@
 import time
-import os
-import csv
 import argparse
-import psutil
+import queue
+import shutil
 import subprocess  
-
-# GPU Details for A100-40GB
-NUM_SMS = 108           # Number of Streaming Multiprocessors (SMs)
-CUDA_CORES_PER_SM = 64  # CUDA Cores per SM
-FP32_INSTRUCTIONS_PER_CYCLE = 2  # Ampere: 2 FP32 instructions per cycle
-FP16_INSTRUCTIONS_PER_CYCLE = 4  # Ampere: FP16 can execute 4 operations per cycle
-
-# Function to run shell commands and return output
-def run_command(command):
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
-    return result.stdout.strip()
-
-
-# # Function to get real-time SM clock speed (MHz)
-# def get_sm_clock():
-#     output = run_command("nvidia-smi --query-gpu=clocks.sm --format=csv,noheader,nounits")
-#     return float(output) * 1e6  # Convert MHz to Hz
-
-
-# Function to get DCGM metrics: fp32_active, fp64_active, fp16_active, sm_active
-def get_dcgm_metrics():
-    output = run_command("dcgmi dmon -e 1008,1007,1006,1002,100,155,1005 -d 300 -c 3")
-    # print(output)
-    lines = output.split("\n")
-    fp16_active, fp32_active, fp64_active, sm_active, sm_clock, power, dram_active = 0,0,0,0,0,0,0
-    for i in range(2, len(lines)):
-        values = lines[i].split()
-        
-        fp16_active = float(values[2])
-        fp32_active = float(values[3])
-        fp64_active = float(values[4])
-        sm_active = float(values[5])
-        sm_clock = float(values[6])
-        power = float(values[7])
-        dram_active = float(values[8])
-        
-        if (fp32_active > 0 or fp64_active > 0 or fp16_active > 0) and sm_active > 0:
-            return fp16_active, fp32_active, fp64_active, sm_active, sm_clock, power, dram_active
-    
-    return fp16_active, fp32_active, fp64_active, sm_active, sm_clock, power, dram_active
-
-# Function to calculate real-time FLOPS
-def calculate_flops(sm_clock_hz, fp_active, sm_active, precision="FP32"):
-    if sm_clock_hz is None or fp_active is None or sm_active is None:
-        return None
-
-    if precision == "FP32":
-        factor = FP32_INSTRUCTIONS_PER_CYCLE
-    elif precision == "FP64":
-        factor = 1  # FP64 has lower throughput
-    elif precision == "FP16":
-        factor = FP16_INSTRUCTIONS_PER_CYCLE
-    else:
-        return None
-
-    flops = sm_clock_hz * fp_active * sm_active * NUM_SMS * CUDA_CORES_PER_SM * factor
-    return flops / 1e12  # Convert to TFLOPS
+import threading
+
+import numpy as np
+
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from gpu_backends import GPU_COLUMNS, make_backend
+from pid_watch import ExitWatcher
+from sampling import DeadlineTicker
+
+
+# DCGM field id -> (CSV column, unit scale applied to the dmon value)
+DCGM_FIELD_COLUMNS = {
+    100: ('SM Clock (MHz)', 1),             # DCGM_FI_DEV_SM_CLOCK
+    155: ('Power (W)', 1),                  # DCGM_FI_DEV_POWER_USAGE
+    156: ('Energy (J)', 1e-3),              # DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION, mJ
+    252: ('FB Used (MiB)', 1),              # DCGM_FI_DEV_FB_USED
+    1002: ('SM Active', 1),                 # DCGM_FI_PROF_SM_ACTIVE
+    1004: ('Tensor Active', 1),             # DCGM_FI_PROF_PIPE_TENSOR_ACTIVE
+    1005: ('DRAM Active', 1),               # DCGM_FI_PROF_DRAM_ACTIVE
+    1006: ('FP64 Active', 1),               # DCGM_FI_PROF_PIPE_FP64_ACTIVE
+    1007: ('FP32 Active', 1),               # DCGM_FI_PROF_PIPE_FP32_ACTIVE
+    1008: ('FP16 Active', 1),               # DCGM_FI_PROF_PIPE_FP16_ACTIVE
+    1009: ('PCIe TX (MB/s)', 1e-6),         # DCGM_FI_PROF_PCIE_TX_BYTES, B/s
+    1010: ('PCIe RX (MB/s)', 1e-6),         # DCGM_FI_PROF_PCIE_RX_BYTES, B/s
+    1011: ('NVLink TX (MB/s)', 1e-6),       # DCGM_FI_PROF_NVLINK_TX_BYTES, B/s
+    1012: ('NVLink RX (MB/s)', 1e-6),       # DCGM_FI_PROF_NVLINK_RX_BYTES, B/s
+}
+
+DEFAULT_FIELDS = [1008, 1007, 1006, 1002, 100, 155, 1005]
+DCGM_PRESETS = {
+    'default': DEFAULT_FIELDS,
+    'transfer': DEFAULT_FIELDS + [1009, 1010, 1011, 1012],
+    'shifting': DEFAULT_FIELDS + [1009, 1010, 1011, 1012, 252, 1004, 156],
+}
+
+# Node totals for these columns are summed over GPUs; everything else is averaged
+SUM_COLUMNS = {'Power (W)', 'Energy (J)', 'FB Used (MiB)',
+               'PCIe TX (MB/s)', 'PCIe RX (MB/s)', 'NVLink TX (MB/s)', 'NVLink RX (MB/s)'}
+
+
+def resolve_fields(spec):
+    """Turn a preset name or a comma-separated list of field ids into a field list."""
+    if spec in DCGM_PRESETS:
+        return list(DCGM_PRESETS[spec])
+    fields = [int(f) for f in spec.split(',')]
+    unknown = [f for f in fields if f not in DCGM_FIELD_COLUMNS]
+    if unknown:
+        raise ValueError(f"No column mapping for DCGM field(s) {unknown}")
+    return fields
+
+
+def field_layout(fields):
+    """Return (columns, order, scale) for a dmon field list.
+
+    Columns that existed in the original trace keep their position at the
+    front (GPU_COLUMNS order), the rest follow in the order requested.
+    `order` maps output columns to dmon positions and `scale` converts units,
+    so per-row work is one fancy index and one multiply however many fields
+    are selected.
+    """
+    def rank(i):
+        column = DCGM_FIELD_COLUMNS[fields[i]][0]
+        return (GPU_COLUMNS.index(column), 0) if column in GPU_COLUMNS else (len(GPU_COLUMNS), i)
+    order = sorted(range(len(fields)), key=rank)
+    columns = [DCGM_FIELD_COLUMNS[fields[i]][0] for i in order]
+    scale = np.array([DCGM_FIELD_COLUMNS[fields[i]][1] for i in order], dtype=float)
+    return columns, np.array(order), scale
+
+
+def parse_dcgm_value(value):
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0  # N/A while the field warms up
+
+
+class DcgmBlockParser:
+    """Collects `dcgmi dmon` lines into one (num_gpu, num_fields) block per interval.
+
+    dmon prints one line per GPU each interval; feed() takes a line and its
+    arrival time (time.monotonic) and returns the (t, block) of an interval
+    once every GPU reported or the next interval started, else None. t is
+    the arrival time of the interval's first line; a GPU that did not
+    report is NaN.
+    """
+
+    def __init__(self, fields, gpu_ids):
+        self.n = len(fields)
+        self.gpu_ids = list(gpu_ids)
+        self.index = {gpu_id: i for i, gpu_id in enumerate(self.gpu_ids)}
+        self.pending = [None] * len(self.gpu_ids)
+        self.filled = 0
+        self.t_block = None
+
+    def block(self):
+        pending = self.pending
+        self.pending = [None] * len(self.gpu_ids)
+        self.filled = 0
+        # all devices of one interval are converted together
+        if None not in pending:
+            try:
+                return self.t_block, np.array(pending, dtype=float)
+            except ValueError:
+                pass  # N/A somewhere, fall back to per-value parsing
+        block = np.full((len(self.gpu_ids), self.n), np.nan)
+        for i, tokens in enumerate(pending):
+            if tokens is not None:
+                block[i] = [parse_dcgm_value(v) for v in tokens]
+        return self.t_block, block
+
+    def feed(self, t, line):
+        values = line.split()
+        # data lines look like: GPU 0  v1 v2 ... ; skip headers and blanks
+        if len(values) < 2 + self.n or values[0] != "GPU":
+            return None
+        try:
+            i = self.index[int(values[1])]
+        except (ValueError, KeyError):
+            return None
+        done = None
+        if self.pending[i] is not None:
+            # next interval started before every GPU reported
+            done = self.block()
+        if self.filled == 0:
+            self.t_block = t
+        self.pending[i] = values[2:2 + self.n]
+        self.filled += 1
+        if self.filled == len(self.gpu_ids):
+            done = self.block()
+        return done
+
+    def flush(self):
+        return self.block() if self.filled else None
+
+
+def dcgmi_command(fields, delay_ms, gpu_ids):
+    cmd = ["dcgmi", "dmon", "-e", ",".join(map(str, fields)), "-d", str(delay_ms),
+           "-i", ",".join(map(str, gpu_ids))]
+    # dcgmi block-buffers stdout into a pipe; force line buffering so
+    # arrival stamps match when DCGM produced the row
+    if shutil.which("stdbuf"):
+        cmd = ["stdbuf", "-oL"] + cmd
+    return cmd
+
+
+class DcgmStream:
+    """One long-lived `dcgmi dmon` child parsed line by line on a reader thread.
+
+    Replaces a `dcgmi dmon -c 3` spawn per sample. The reader queues one
+    (t, block) per interval (see DcgmBlockParser), with block in gpu_ids
+    order. A final None marks EOF after stop().
+    """
+
+    def __init__(self, fields=DEFAULT_FIELDS, delay_ms=100, gpu_ids=(0,)):
+        self.fields = list(fields)
+        self.gpu_ids = list(gpu_ids)
+        self.cmd = dcgmi_command(self.fields, delay_ms, self.gpu_ids)
+        self.rows = queue.Queue()
+        self.proc = None
+        self.start_time = None
+
+    def start(self):
+        self.proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.start_time = time.monotonic()
+        threading.Thread(target=self._read, name="dcgmi-reader", daemon=True).start()
+        return self
+
+    def _read(self):
+        parser = DcgmBlockParser(self.fields, self.gpu_ids)
+        for line in self.proc.stdout:
+            done = parser.feed(time.monotonic(), line)
+            if done is not None:
+                self.rows.put(done)
+        done = parser.flush()
+        if done is not None:
+            self.rows.put(done)
+        self.rows.put(None)
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+def gpu_headers(columns, num_gpu):
+    """Node columns first (same names as the single-GPU trace), then per-GPU columns."""
+    headers = ['Time (s)'] + columns
+    if num_gpu > 1:
+        headers += [f'GPU{i} {column}' for i in range(num_gpu) for column in columns]
+    return headers
+
+
+def gpu_row(elapsed_time, block, sum_mask, power_index=None):
+    """Build a CSV row from a (num_gpu, len(columns)) array.
+
+    Node columns are the mean over GPUs, or the total where sum_mask is set
+    (power, energy, traffic, memory used).
+    """
+    node = np.nanmean(block, axis=0)
+    node[sum_mask] = np.nansum(block[:, sum_mask], axis=0)
+    row = [elapsed_time] + node.tolist()
+    if power_index is not None:
+        row[1 + power_index] = int(row[1 + power_index])
+    if block.shape[0] > 1:
+        row += block.ravel().tolist()
+    return row
+
+
+def column_aggregation(columns):
+    sum_mask = np.array([column in SUM_COLUMNS for column in columns])
+    power_index = columns.index('Power (W)') if 'Power (W)' in columns else None
+    return sum_mask, power_index
 
 # Function to monitor GPU performance
-def monitor_gpu_performance(benchmark_pid, output_csv, interval=0.1):
-    start_time = time.time()
-    performance_data = []
-    
-    while psutil.pid_exists(benchmark_pid):
-        time.sleep(interval)
-        elapsed_time = time.time() - start_time
-        # sm_clock_hz = get_sm_clock()
-        fp16_active, fp32_active, fp64_active, sm_active, sm_clock_hz, power, dram_active = get_dcgm_metrics()
-
-        # fp32_flops = calculate_flops(sm_clock_hz, fp32_active, sm_active, precision="FP32")
-        # fp64_flops = calculate_flops(sm_clock_hz, fp64_active, sm_active, precision="FP64")
-        # fp16_flops = calculate_flops(sm_clock_hz, fp16_active, sm_active, precision="FP16")
-        
-        row = [elapsed_time, sm_clock_hz, dram_active, fp16_active, fp32_active, fp64_active, int(power)]
-        performance_data.append(row)
-    
-    with open(output_csv, 'w', newline='') as file:
-        os.makedirs(os.path.dirname(output_csv), exist_ok=True)
-        writer = csv.writer(file)
-        headers = ['Time (s)', 'SM Clock (MHz)', 'DRAM Active', 'FP16 Active', 'FP32 Active', 'FP64 Active', 'Power (W)']
-        writer.writerow(headers)
-        writer.writerows(performance_data)
+def monitor_gpu_performance(benchmark_pid, output_csv, interval=0.1, fsync_interval=FSYNC_INTERVAL, num_gpu=1,
+                            fields=DEFAULT_FIELDS):
+    columns, order, scale = field_layout(fields)
+    sum_mask, power_index = column_aggregation(columns)
+
+    stream = DcgmStream(fields, delay_ms=int(interval * 1000), gpu_ids=range(num_gpu)).start()
+    watcher = ExitWatcher(benchmark_pid).start()
+    # stopping dcgmi closes its stdout, so the reader drains what is left and ends the queue
+    watcher.on_exit(stream.stop)
+    rows = 0
+    with StreamingCsvWriter(output_csv, gpu_headers(columns, num_gpu), fsync_interval=fsync_interval) as writer:
+        writer.set_start(stream.start_time)
+        while True:
+            item = stream.rows.get()
+            if item is None:
+                break
+            t, block = item
+            writer.writerow(gpu_row(t - stream.start_time, block[:, order] * scale, sum_mask, power_index))
+            rows += 1
+    stream.stop()
+    print(f"read_gpu_metrics: {rows} rows for {num_gpu} GPU(s) from one dcgmi dmon stream")
+
+# Polled in-process backends (NVML, fake device) share the deadline ticker
+def monitor_polled_gpu(benchmark_pid, output_csv, backend, interval=0.1, fsync_interval=FSYNC_INTERVAL):
+    gpu_ids = backend.gpu_ids()
+    columns = GPU_COLUMNS + ['Energy (J)']
+    sum_mask, power_index = column_aggregation(columns)
+
+    watcher = ExitWatcher(benchmark_pid).start()
+    ticker = DeadlineTicker(interval)
+    try:
+        with StreamingCsvWriter(output_csv, gpu_headers(columns, len(gpu_ids)), fsync_interval=fsync_interval) as writer:
+            writer.set_start(ticker.start)
+            while True:
+                now, _ = ticker.wait(watcher.exited)
+                samples = [backend.sample(gpu_id) for gpu_id in gpu_ids]
+                block = np.array([[sample[column] for column in columns] for sample in samples])
+                writer.writerow(gpu_row(now - ticker.start, block, sum_mask, power_index))
+                if watcher.exited.is_set():
+                    break
+    finally:
+        backend.close()
+    print(f"read_gpu_metrics: {ticker.index} ticks, {ticker.late_ticks} late, {ticker.skipped_ticks} skipped")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Monitor GPU performance.')
     parser.add_argument('--pid', type=int, help='PID of the benchmark process', required=True)
     parser.add_argument('--output_csv', type=str, help='Output CSV file path', required=True)
-    parser.add_argument('--num_gpu', type=int)
+    parser.add_argument('--num_gpu', type=int, default=1, help='Number of GPUs to sample (per-GPU columns when > 1)')
+    parser.add_argument('--interval', type=float, default=0.1, help='Sampling interval in seconds')
+    parser.add_argument('--backend', type=str, default='dcgm', choices=['dcgm', 'nvml', 'fake'],
+                        help='dcgmi dmon stream, in-process NVML, or a fake device for CPU-only testing')
+    parser.add_argument('--fields', type=str, default='default',
+                        help=f'DCGM preset ({", ".join(DCGM_PRESETS)}) or comma-separated field ids')
+    parser.add_argument('--fsync_interval', type=float, default=FSYNC_INTERVAL, help='Seconds between fsyncs of the output CSV')
     args = parser.parse_args()
     
-    monitor_gpu_performance(args.pid, args.output_csv)
-
-
-
-
-
-    ## below for multi-gpu reading
-# import time
-# import os
-# import csv
-# import argparse
-# import psutil
-# import subprocess  
-
-# num_gpu = 1
-# # GPU Details for A100-40GB
-# NUM_SMS = 108           # Number of Streaming Multiprocessors (SMs)
-# CUDA_CORES_PER_SM = 64  # CUDA Cores per SM
-# FP32_INSTRUCTIONS_PER_CYCLE = 2  # Ampere: 2 FP32 instructions per cycle
-# FP16_INSTRUCTIONS_PER_CYCLE = 4  # Ampere: FP16 can execute 4 operations per cycle
-
-# # Function to run shell commands and return output
-# def run_command(command):
-#     result = subprocess.run(command, shell=True, capture_output=True, text=True)
-#     return result.stdout.strip()
-
-
-# # # Function to get real-time SM clock speed (MHz)
-# # def get_sm_clock():
-# #     output = run_command("nvidia-smi --query-gpu=clocks.sm --format=csv,noheader,nounits")
-# #     return float(output) * 1e6  # Convert MHz to Hz
-
-
-# # Function to get DCGM metrics: fp32_active, fp64_active, fp16_active, sm_active
-# def get_dcgm_metrics():
-#     output = run_command("dcgmi dmon -e 1008,1007,1006,1002,100,155,1005 -d 300 -c 3")
-#     lines = output.split("\n")
-
-#     # Step 1: Filter lines where GPU ID < num_gpu
-#     filtered_lines = []
-#     for line in lines:
-#         values = line.strip().split()
-
-#         # Skip if not a data line or too short
-#         if len(values) < 9:
-#             continue
-#         if values[0] != "GPU":
-#             continue
-
-#         try:
-#             gpu_id = int(values[1])
-#         except ValueError:
-#             continue  # Skip lines like headers where values[1] is not an integer
-
-#         if gpu_id < num_gpu:
-#             filtered_lines.append(values)
-
-#     # Step 2: Group every num_gpu rows
-#     grouped = [filtered_lines[i:i+num_gpu] for i in range(0, len(filtered_lines), num_gpu)]
-
-#     # Step 3: Average metrics per group
-#     second_filtered_lines = []
-#     for group in grouped:
-#         if len(group) != num_gpu:
-#             continue  # skip incomplete group
-
-#         acc = [0.0] * 7  # for fp16, fp32, fp64, sm, clock, power, dram
-
-#         for values in group:
-#             for i in range(7):
-#                 acc[i] += float(values[2 + i])  # values[2] to values[8]
-
-#         avg = [x / num_gpu for x in acc]
-#         second_filtered_lines.append(avg)
-    
-#     # Step 4: Return the first active line
-#     fp16_active, fp32_active, fp64_active, sm_active, sm_clock, power, dram_active = 0,0,0,0,0,0,0
-#     for line in second_filtered_lines:
-#         fp16_active, fp32_active, fp64_active, sm_active, sm_clock, power, dram_active = line
-#         if (fp16_active > 0 or fp32_active > 0 or fp64_active > 0) and sm_active > 0:
-#             return fp16_active, fp32_active, fp64_active, sm_active, sm_clock, power, dram_active
-
-#     # Fallback return if no activity found
-#     return fp16_active, fp32_active, fp64_active, sm_active, sm_clock, power, dram_active
-
-
-
-# # Function to calculate real-time FLOPS
-# def calculate_flops(sm_clock_hz, fp_active, sm_active, precision="FP32"):
-#     if sm_clock_hz is None or fp_active is None or sm_active is None:
-#         return None
-
-#     if precision == "FP32":
-#         factor = FP32_INSTRUCTIONS_PER_CYCLE
-#     elif precision == "FP64":
-#         factor = 1  # FP64 has lower throughput
-#     elif precision == "FP16":
-#         factor = FP16_INSTRUCTIONS_PER_CYCLE
-#     else:
-#         return None
-
-#     flops = sm_clock_hz * fp_active * sm_active * NUM_SMS * CUDA_CORES_PER_SM * factor
-#     return flops / 1e12  # Convert to TFLOPS
-
-# # Function to monitor GPU performance
-# def monitor_gpu_performance(benchmark_pid, output_csv, interval=0.1):
-#     start_time = time.time()
-#     performance_data = []
-    
-#     while psutil.pid_exists(benchmark_pid):
-#         time.sleep(interval)
-#         elapsed_time = time.time() - start_time
-#         # sm_clock_hz = get_sm_clock()
-#         fp16_active, fp32_active, fp64_active, sm_active, sm_clock_hz, power, dram_active = get_dcgm_metrics()
-
-#         # fp32_flops = calculate_flops(sm_clock_hz, fp32_active, sm_active, precision="FP32")
-#         # fp64_flops = calculate_flops(sm_clock_hz, fp64_active, sm_active, precision="FP64")
-#         # fp16_flops = calculate_flops(sm_clock_hz, fp16_active, sm_active, precision="FP16")
-        
-#         row = [elapsed_time, sm_clock_hz, dram_active, fp16_active, fp32_active, fp64_active, int(power)]
-#         performance_data.append(row)
-    
-#     with open(output_csv, 'w', newline='') as file:
-#         writer = csv.writer(file)
-#         headers = ['Time (s)', 'SM Clock (MHz)', 'DRAM Active', 'FP16 Active', 'FP32 Active', 'FP64 Active', 'Power (W)']
-#         writer.writerow(headers)
-#         writer.writerows(performance_data)
-
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description='Monitor GPU performance.')
-#     parser.add_argument('--pid', type=int, help='PID of the benchmark process', required=True)
-#     parser.add_argument('--output_csv', type=str, help='Output CSV file path', required=True)
-#     parser.add_argument('--num_gpu', type=int, required=True)
-#     args = parser.parse_args()
-#     num_gpu = args.num_gpu
-    
-#     monitor_gpu_performance(args.pid, args.output_csv)
\ No newline at end of file
+    exit_on_sigterm()
+    if args.backend == 'dcgm':
+        monitor_gpu_performance(args.pid, args.output_csv, args.interval, args.fsync_interval, args.num_gpu,
+                                resolve_fields(args.fields))
+    else:
+        backend = make_backend(args.backend, args.num_gpu)
+        monitor_polled_gpu(args.pid, args.output_csv, backend, args.interval, args.fsync_interval)
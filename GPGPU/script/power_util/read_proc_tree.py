@@ -0,0 +1,112 @@
+import argparse
+import time
+
+import psutil
+
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from pid_watch import ExitWatcher
+from sampling import DeadlineTicker
+
+PROC_TREE_HEADER = ['Time (s)', 'PID', 'PPID', 'Name', 'CPU User (s)', 'CPU System (s)', 'RSS (MB)', 'Threads']
+
+
+class ProcessTree:
+    """Follows every descendant of a root PID as it appears.
+
+    exp_solo hands the monitors the PID of the `sh -c taskset ... run_X.py`
+    shell; the real workload sits a few levels below (run_X.py -> bash
+    <bench>.sh -> mpirun/binary). Processes are remembered once seen, so a
+    grandchild keeps being followed (and its own children discovered) even
+    after its parent exits and it is reparented.
+    """
+
+    def __init__(self, root_pid):
+        self.root_pid = root_pid
+        self.procs = {}
+        self.last = {}
+        try:
+            self.procs[root_pid] = psutil.Process(root_pid)
+        except psutil.NoSuchProcess:
+            pass
+
+    def refresh(self):
+        """Add new descendants, drop exited ones; return the live psutil.Process list."""
+        children = {}
+        for p in psutil.process_iter(['ppid']):
+            ppid = p.info['ppid']
+            if ppid is not None:
+                children.setdefault(ppid, []).append(p)
+
+        frontier = list(self.procs)
+        while frontier:
+            pid = frontier.pop()
+            for child in children.get(pid, ()):
+                if child.pid not in self.procs:
+                    self.procs[child.pid] = child
+                    frontier.append(child.pid)
+
+        for pid, p in list(self.procs.items()):
+            try:
+                if p.status() == psutil.STATUS_ZOMBIE:
+                    del self.procs[pid]
+            except psutil.NoSuchProcess:
+                del self.procs[pid]
+        return list(self.procs.values())
+
+    def pids(self):
+        return list(self.procs)
+
+    def snapshot(self, final=False):
+        """Refresh and return [pid, ppid, name, user s, system s, rss MB, threads] per descendant.
+
+        Exited processes are dropped by refresh(), so by the final tick
+        (after the benchmark exit) the tree is usually empty. With final,
+        processes that were alive at the previous tick are reported again
+        with their last reading, so the file ends with every process's totals.
+        """
+        rows = {}
+        for p in self.refresh():
+            try:
+                with p.oneshot():
+                    cpu = p.cpu_times()
+                    rows[p.pid] = [p.pid, p.ppid(), p.name(), cpu.user, cpu.system,
+                                   p.memory_info().rss / (1024 * 1024), p.num_threads()]
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        if final:
+            rows = {**self.last, **rows}
+        self.last = rows
+        return list(rows.values())
+
+
+def monitor_proc_tree(benchmark_pid, writer, interval=1.0):
+    tree = ProcessTree(benchmark_pid)
+    watcher = ExitWatcher(benchmark_pid).start()
+    ticker = DeadlineTicker(interval)
+    writer.set_start(ticker.start)
+    seen = set()
+
+    def record(elapsed_time, final=False):
+        for row in tree.snapshot(final):
+            seen.add(row[0])
+            writer.writerow([elapsed_time] + row)
+
+    # a benchmark shorter than one interval would otherwise leave only the header
+    record(time.monotonic() - ticker.start)
+    while not watcher.exited.is_set():
+        now, _ = ticker.wait(watcher.exited)
+        record(now - ticker.start, final=watcher.exited.is_set())
+    print(f"read_proc_tree: followed {len(seen)} processes under PID {benchmark_pid}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Track every descendant of the benchmark process.')
+    parser.add_argument('--pid', type=int, required=True, help='PID of the benchmark process')
+    parser.add_argument('--output_csv', type=str, required=True, help='Output CSV file path')
+    parser.add_argument('--interval', type=float, default=1.0, help='Sampling interval in seconds')
+    parser.add_argument('--fsync_interval', type=float, default=FSYNC_INTERVAL, help='Seconds between fsyncs of the output CSV')
+    args = parser.parse_args()
+
+    exit_on_sigterm()
+    with StreamingCsvWriter(args.output_csv, PROC_TREE_HEADER, fsync_interval=args.fsync_interval) as writer:
+        monitor_proc_tree(args.pid, writer, args.interval)
@@ -0,0 +1,105 @@
+import os
+import subprocess
+
+from read_proc_tree import ProcessTree
+
+RESCTRL_PATH = "/sys/fs/resctrl"
+MBM_EVENTS = ("mbm_total_bytes", "mbm_local_bytes")
+
+
+def resctrl_mounted(root=RESCTRL_PATH, mounts="/proc/mounts"):
+    try:
+        with open(mounts) as f:
+            return any(line.split()[1:3] == [root, "resctrl"] for line in f if len(line.split()) > 2)
+    except OSError:
+        return False
+
+
+def ensure_resctrl(root=RESCTRL_PATH):
+    if not resctrl_mounted(root):
+        subprocess.run(["mount", "-t", "resctrl", "resctrl", root], check=True)
+    if not os.path.isdir(os.path.join(root, "info", "L3_MON")):
+        raise RuntimeError("resctrl has no L3_MON: this CPU or kernel does not support MBM")
+
+
+class MbmGroup:
+    """resctrl monitoring group that follows the benchmark's process tree.
+
+    The group is created for one run and removed afterwards (the kernel
+    hands its tasks back to the default group on rmdir). resctrl tasks are
+    threads, so every thread of every descendant is written in; threads
+    and children created later inherit the group, and refresh() catches
+    anything that appears through other paths. The mbm_*_bytes files are
+    opened once and re-read with os.preadv, as in RaplReader.
+    """
+
+    def __init__(self, root_pid, name=None, root=RESCTRL_PATH):
+        ensure_resctrl(root)
+        self.path = os.path.join(root, "mon_groups", name or f"power_mbm_{root_pid}")
+        os.makedirs(self.path, exist_ok=True)
+        self.tree = ProcessTree(root_pid)
+        self.attached = set()
+        self.refresh()
+
+        self.fds = {event: [] for event in MBM_EVENTS}
+        mon_data = os.path.join(self.path, "mon_data")
+        for domain in sorted(os.listdir(mon_data)):
+            for event in MBM_EVENTS:
+                fpath = os.path.join(mon_data, domain, event)
+                if os.path.isfile(fpath):
+                    self.fds[event].append(os.open(fpath, os.O_RDONLY))
+        if not self.fds["mbm_total_bytes"]:
+            self.close()
+            raise RuntimeError(f"No mbm_total_bytes files under {mon_data}")
+        self.buf = bytearray(32)
+        self.bufs = [self.buf]
+        self.unavailable = 0
+
+    def refresh(self):
+        """Attach threads of descendants not seen yet; return how many were added."""
+        added = 0
+        tasks = os.path.join(self.path, "tasks")
+        self.tree.refresh()
+        for pid in self.tree.pids():
+            try:
+                tids = os.listdir(f"/proc/{pid}/task")
+            except OSError:
+                continue
+            for tid in tids:
+                if tid in self.attached:
+                    continue
+                try:
+                    with open(tasks, "w") as f:
+                        f.write(tid)
+                    self.attached.add(tid)
+                    added += 1
+                except OSError:
+                    continue  # thread exited in the meantime
+        return added
+
+    def read(self):
+        """Return {event: bytes summed over L3 domains}."""
+        totals = {}
+        for event, fds in self.fds.items():
+            total = 0
+            for fd in fds:
+                try:
+                    n = os.preadv(fd, self.bufs, 0)
+                    total += int(self.buf[:n])
+                except (OSError, ValueError):
+                    self.unavailable += 1  # 'Unavailable' until the RMID has data
+            totals[event] = total
+        return totals
+
+    def close(self):
+        for fds in self.fds.values():
+            for fd in fds:
+                os.close(fd)
+        self.fds = {event: [] for event in MBM_EVENTS}
+
+    def remove(self):
+        self.close()
+        try:
+            os.rmdir(self.path)
+        except OSError as e:
+            print(f"Cannot remove resctrl group {self.path}: {e}")
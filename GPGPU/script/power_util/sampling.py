@@ -0,0 +1,58 @@
+import time
+
+# Below this much time to the deadline we stop sleeping and spin, since
+# time.sleep() can overshoot by ~50-100 us which matters for 1-10 ms ticks
+SPIN_S = 0.0002
+
+
+class DeadlineTicker:
+    """Fixed-rate tick source driven by absolute monotonic deadlines.
+
+    Deadline k is start + k * interval, so sleep overshoot and the work done
+    between ticks never accumulate into drift. If the caller falls behind by
+    one or more whole intervals, the missed ticks are counted and skipped
+    rather than fired back-to-back.
+    """
+
+    def __init__(self, interval, start=None, spin=SPIN_S):
+        self.interval = interval
+        self.spin = spin
+        self.start = time.monotonic() if start is None else start
+        self.index = 0            # index of the last tick returned
+        self.late_ticks = 0       # ticks that fired more than spin past their deadline
+        self.skipped_ticks = 0    # deadlines that were never fired
+
+    def next_deadline(self):
+        return self.start + (self.index + 1) * self.interval
+
+    def wait(self, stop=None):
+        """Block until the next deadline; return (now, skipped).
+
+        If `stop` (a threading.Event) is set while sleeping, return right away
+        so the caller can take a final sample at the moment it fired.
+        """
+        deadline = self.next_deadline()
+        now = time.monotonic()
+        remaining = deadline - now
+        if remaining > self.spin:
+            if stop is None:
+                time.sleep(remaining - self.spin)
+            elif stop.wait(remaining - self.spin):
+                return time.monotonic(), 0
+        while now < deadline:
+            now = time.monotonic()
+        return now, self.advance(now)
+
+    def advance(self, now):
+        """Mark the tick at next_deadline() fired at `now`; return the ticks skipped.
+
+        Non-blocking half of wait(), for callers that do their own waiting
+        (e.g. an asyncio loop sleeping until next_deadline()).
+        """
+        late = now - self.next_deadline()
+        skipped = max(int(late // self.interval), 0)
+        if late > self.spin:
+            self.late_ticks += 1
+        self.skipped_ticks += skipped
+        self.index += 1 + skipped
+        return skipped
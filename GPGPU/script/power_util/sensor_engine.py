@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import os
+import signal
+import time
+
+from collector import CpuCounterSensor, CpuPowerSensor, MbmSensor, PolledGpuSensor, ProcTreeSensor
+from csv_stream import FSYNC_INTERVAL, StreamingCsvWriter, exit_on_sigterm
+from perf_stat import IntervalGrouper, MultiplexSummary
+from pid_watch import ExitWatcher
+from read_cpu_counters import cpu_counters_perf_cmd, cpu_metrics_header, perf_interval_row
+from read_gpu_metrics import (DEFAULT_FIELDS, DcgmBlockParser, column_aggregation, dcgmi_command, field_layout,
+                              gpu_headers, gpu_row, resolve_fields)
+from sampling import DeadlineTicker
+from shm_ring import ShmRing, ring_name
+from uncore_pmu import UncorePmus
+
+QUEUE_SIZE = 4096      # samples buffered between the sensors and the CSV writer
+WRITE_BATCH = 256      # samples handed to the writer thread at once
+LAG_WARN_S = 1.0       # samples written later than this after being taken count as lagged
+
+
+class TickSensor:
+    """Runs a collector Sensor (RAPL, perf_event, resctrl, NVML, ...) on its own cadence.
+
+    Deadlines come from a DeadlineTicker anchored at the engine's t0; the
+    loop awaits next_deadline() and then advances the ticker, so missed
+    deadlines are counted and skipped exactly as in the threaded monitors. sample() is called on the event
+    loop, so it must be a few preadv()s; with offload=True it runs in a
+    worker thread instead (psutil scans, NVML calls).
+    """
+
+    def __init__(self, sensor, offload=False):
+        self.sensor = sensor
+        self.name = sensor.name
+        self.interval = sensor.interval
+        self.offload = offload
+        self.numeric = sensor.numeric
+        self.ticker = None
+
+    def open(self):
+        self.sensor.open()
+
+    def header(self):
+        return self.sensor.header()
+
+    async def sample(self, dt, skipped):
+        if self.offload:
+            return await asyncio.to_thread(self.sensor.sample, dt, skipped)
+        return self.sensor.sample(dt, skipped)
+
+    async def run(self, engine):
+        sensor = self.sensor
+        sensor.begin(engine)
+        self.ticker = ticker = DeadlineTicker(self.interval, start=engine.t0)
+        try:
+            prev = engine.t0
+            if sensor.sample_at_start:
+                prev = time.monotonic()
+                for row in await self.sample(max(prev - engine.t0, 1e-6), 0):
+                    engine.publish(self.name, prev, [prev - engine.t0] + row)
+            while True:
+                remaining = ticker.next_deadline() - time.monotonic()
+                if remaining > 0:
+                    try:
+                        # benchmark exit cuts the wait short for one final sample
+                        await asyncio.wait_for(engine.stop.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                now = time.monotonic()
+                skipped = ticker.advance(now)
+                dt = max(now - prev, 1e-6)
+                prev = now
+                for row in await self.sample(dt, skipped):
+                    engine.publish(self.name, now, [now - engine.t0] + row)
+                if engine.stop.is_set():
+                    break
+        finally:
+            sensor.end()
+
+    def close(self):
+        self.sensor.close()
+
+    def summary(self):
+        if self.ticker is None:
+            return "not started"
+        return f"{self.ticker.late_ticks} late ticks, {self.ticker.skipped_ticks} skipped"
+
+
+class StreamSensor:
+    """A monitoring child (perf, dcgmi) whose output is read with asyncio streams.
+
+    A line that does not arrive within stall_timeout is counted as a stall
+    instead of blocking the sampler; the benchmark's exit sends stop_signal
+    and the remaining output is drained to EOF. Subclasses provide
+    command(), on_line(now, line) and on_eof(), both returning
+    [(t, row), ...].
+    """
+
+    name = None
+    numeric = True
+    stop_signal = signal.SIGTERM
+    from_stderr = False
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stall_timeout = max(4 * interval, 1.0)
+        self.stalls = 0
+        self.lines = 0
+
+    def open(self):
+        pass
+
+    def header(self):
+        raise NotImplementedError
+
+    def command(self):
+        raise NotImplementedError
+
+    def on_line(self, now, line):
+        raise NotImplementedError
+
+    def on_eof(self):
+        return []
+
+    async def run(self, engine):
+        self.t0 = engine.t0
+        pipe = asyncio.subprocess.PIPE
+        devnull = asyncio.subprocess.DEVNULL
+        proc = await asyncio.create_subprocess_exec(*self.command(), stdin=devnull,
+                                                    stdout=devnull if self.from_stderr else pipe,
+                                                    stderr=pipe if self.from_stderr else devnull)
+        stream = proc.stderr if self.from_stderr else proc.stdout
+        stop = asyncio.ensure_future(engine.stop.wait())
+        read = None
+        stopping = False
+        try:
+            while True:
+                if read is None:
+                    read = asyncio.ensure_future(stream.readline())
+                waits = {read} if stopping else {read, stop}
+                done, _ = await asyncio.wait(waits, timeout=self.stall_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.stalls += 1
+                    if stopping:
+                        break  # the child ignored stop_signal; kill it below
+                    continue
+                if stop in done and not stopping:
+                    stopping = True
+                    if proc.returncode is None:
+                        proc.send_signal(self.stop_signal)
+                if read in done:
+                    line = read.result()
+                    read = None
+                    if not line:
+                        break
+                    self.lines += 1
+                    for t, row in self.on_line(time.monotonic(), line.decode()):
+                        engine.publish(self.name, t, row)
+            for t, row in self.on_eof():
+                engine.publish(self.name, t, row)
+        finally:
+            for task in (read, stop):
+                if task is not None:
+                    task.cancel()
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return f"{self.lines} lines, {self.stalls} stalls"
+
+
+class PerfCounterStream(StreamSensor):
+    """read_cpu_counters' perf stat session (IPS, LLC misses, IMC/UPI bandwidth)."""
+
+    name = "cpu_metrics"
+    # SIGINT makes perf print the last (partial) interval before exiting
+    stop_signal = signal.SIGINT
+    from_stderr = True
+
+    def open(self):
+        self.uncore = UncorePmus()
+        self.grouper = IntervalGrouper()
+        self.multiplex = MultiplexSummary()
+        self.prev_ts = 0.0
+
+    def header(self):
+        return cpu_metrics_header(self.uncore)
+
+    def command(self):
+        return cpu_counters_perf_cmd(self.uncore, self.interval)
+
+    def interval_row(self, now, done):
+        ts, samples = done
+        dt = max(ts - self.prev_ts, 1e-6)
+        self.prev_ts = ts
+        # rows are stamped on the engine's timebase; dt stays perf's own
+        return [(now, perf_interval_row(self.uncore, now - self.t0, dt, samples, multiplex=self.multiplex))]
+
+    def on_line(self, now, line):
+        done = self.grouper.feed(line)
+        return [] if done is None else self.interval_row(now, done)
+
+    def on_eof(self):
+        done = self.grouper.flush()
+        return [] if done is None else self.interval_row(time.monotonic(), done)
+
+    def summary(self):
+        return f"{super().summary()}\n{self.multiplex.report()}"
+
+
+class DcgmSensor(StreamSensor):
+    """dcgmi dmon stream; each interval's block is stamped with its arrival time."""
+
+    name = "gpu_metrics"
+
+    def __init__(self, interval=0.1, num_gpu=1, fields=DEFAULT_FIELDS):
+        super().__init__(interval)
+        self.num_gpu = num_gpu
+        self.fields = list(fields)
+
+    def open(self):
+        self.columns, self.order, self.scale = field_layout(self.fields)
+        self.sum_mask, self.power_index = column_aggregation(self.columns)
+        self.parser = DcgmBlockParser(self.fields, range(self.num_gpu))
+
+    def header(self):
+        return gpu_headers(self.columns, self.num_gpu)
+
+    def command(self):
+        return dcgmi_command(self.fields, int(self.interval * 1000), range(self.num_gpu))
+
+    def block_row(self, done):
+        t, block = done
+        return [(t, gpu_row(t - self.t0, block[:, self.order] * self.scale, self.sum_mask, self.power_index))]
+
+    def on_line(self, now, line):
+        done = self.parser.feed(now, line)
+        return [] if done is None else self.block_row(done)
+
+    def on_eof(self):
+        done = self.parser.flush()
+        return [] if done is None else self.block_row(done)
+
+
+class SensorEngine:
+    """Samples every sensor on one asyncio loop and writes their CSVs through a bounded queue.
+
+    Sensors publish (t, row) samples without waiting; a writer task hands
+    batches to a worker thread, so a slow disk or an fsync never delays a
+    tick. When the queue is full the new sample is dropped and counted per
+    sensor; samples written more than LAG_WARN_S after they were taken are
+    counted as lagged.
+    """
+
+    def __init__(self, pid, sensors, outputs, queue_size=QUEUE_SIZE, fsync_interval=FSYNC_INTERVAL, shm=False):
+        self.pid = pid
+        self.shm = shm
+        self.rings = {}
+        self.sensors = []
+        for sensor in sensors:
+            try:
+                sensor.open()
+                self.sensors.append(sensor)
+            except Exception as e:
+                print(f"sensor_engine: {sensor.name} unavailable: {e}")
+        self.outputs = outputs
+        self.queue_size = queue_size
+        self.fsync_interval = fsync_interval
+        self.drops = {sensor.name: 0 for sensor in self.sensors}
+        self.errors = {}
+        self.max_depth = 0
+        self.max_lag = 0.0
+        self.lagged = 0
+        self.writers = {}
+
+    def publish(self, name, t, row):
+        ring = self.rings.get(name)
+        if ring is not None:
+            # live readers see the sample at once, whatever the writer's backlog
+            ring.publish(self.t0 + row[0], row[1:])
+        try:
+            self.queue.put_nowait((name, t, row))
+        except asyncio.QueueFull:
+            self.drops[name] += 1
+            return
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def write_batch(self, batch):
+        for name, _, row in batch:
+            self.writers[name].writerow(row)
+
+    async def write(self):
+        done = False
+        while not done:
+            batch = [await self.queue.get()]
+            while len(batch) < WRITE_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if not batch:
+                continue
+            now = time.monotonic()
+            for _, t, _ in batch:
+                lag = now - t
+                if lag > LAG_WARN_S:
+                    self.lagged += 1
+                if lag > self.max_lag:
+                    self.max_lag = lag
+            await asyncio.to_thread(self.write_batch, batch)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop = asyncio.Event()
+        self.queue = asyncio.Queue(self.queue_size)
+        for sensor in self.sensors:
+            self.writers[sensor.name] = StreamingCsvWriter(self.outputs[sensor.name], sensor.header(),
+                                                           fsync_interval=self.fsync_interval)
+            if self.shm and sensor.numeric:
+                self.rings[sensor.name] = ShmRing.create(ring_name(sensor.name), sensor.header()[1:])
+        self.t0 = time.monotonic()
+        for w in self.writers.values():
+            w.set_start(self.t0)
+        watcher = ExitWatcher(self.pid).start()
+        watcher.on_exit(lambda: loop.call_soon_threadsafe(self.stop.set))
+        writer = asyncio.ensure_future(self.write())
+        try:
+            results = await asyncio.gather(*(sensor.run(self) for sensor in self.sensors), return_exceptions=True)
+            for sensor, result in zip(self.sensors, results):
+                if isinstance(result, Exception):
+                    self.errors[sensor.name] = repr(result)
+            # the sentinel may wait for room, the writer is still draining
+            await self.queue.put(None)
+            await writer
+        finally:
+            writer.cancel()
+            for w in self.writers.values():
+                w.close()
+            for sensor in self.sensors:
+                sensor.close()
+            for ring in self.rings.values():
+                ring.close()
+
+    def report(self):
+        lines = []
+        for sensor in self.sensors:
+            rows = self.writers[sensor.name].rows if sensor.name in self.writers else 0
+            lines.append(f"  {sensor.name}: {rows} rows, {self.drops[sensor.name]} dropped, {sensor.summary()}")
+            if sensor.name in self.errors:
+                lines.append(f"  {sensor.name}: failed with {self.errors[sensor.name]}")
+        lines.append(f"  writer: queue high-water {self.max_depth}/{self.queue_size}, "
+                     f"max lag {self.max_lag:.3f} s, {self.lagged} samples lagged > {LAG_WARN_S} s")
+        return "\n".join(lines)
+
+
+def build_sensors(args):
+    sensors = []
+    if args.cpu_power_interval > 0:
+        sensors.append(TickSensor(CpuPowerSensor(args.cpu_power_interval, args.rapl_backend)))
+    if args.counters_interval > 0:
+        if args.counters_backend == "perf_event":
+            sensors.append(TickSensor(CpuCounterSensor(args.counters_interval)))
+        else:
+            sensors.append(PerfCounterStream(args.counters_interval))
+    if args.mbm_interval > 0:
+        sensors.append(TickSensor(MbmSensor(args.mbm_interval)))
+    if args.gpu_interval > 0 and args.num_gpu > 0:
+        if args.gpu_backend == "dcgm":
+            sensors.append(DcgmSensor(args.gpu_interval, args.num_gpu, resolve_fields(args.fields)))
+        else:
+            sensors.append(TickSensor(PolledGpuSensor(args.gpu_interval, args.gpu_backend, args.num_gpu),
+                                      offload=args.gpu_backend == "nvml"))
+    if args.proc_interval > 0:
+        sensors.append(TickSensor(ProcTreeSensor(args.proc_interval), offload=True))
+    return sensors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sample every power_util sensor on one asyncio loop, '
+                                                 'each at its own cadence (0 disables a sensor).')
+    parser.add_argument('--pid', type=int, required=True, help='PID of the benchmark process')
+    parser.add_argument('--output_dir', type=str, required=True, help='Directory for <sensor>.csv outputs')
+    parser.add_argument('--cpu_power_interval', type=float, default=0.5, help='RAPL interval in seconds')
+    parser.add_argument('--rapl_backend', type=str, default='sysfs', choices=['sysfs', 'msr'])
+    parser.add_argument('--counters_interval', type=float, default=0.5, help='CPU counter interval in seconds')
+    parser.add_argument('--counters_backend', type=str, default='perf', choices=['perf', 'perf_event'],
+                        help='perf: async perf stat stream; perf_event: in-process counters on the tick scheduler')
+    parser.add_argument('--mbm_interval', type=float, default=0, help='resctrl MBM interval in seconds')
+    parser.add_argument('--gpu_interval', type=float, default=0.1, help='GPU interval in seconds')
+    parser.add_argument('--gpu_backend', type=str, default='dcgm', choices=['dcgm', 'nvml', 'fake'])
+    parser.add_argument('--num_gpu', type=int, default=1, help='Number of GPUs to sample')
+    parser.add_argument('--fields', type=str, default='default', help='DCGM preset or comma-separated field ids')
+    parser.add_argument('--proc_interval', type=float, default=1.0, help='Process tree interval in seconds')
+    parser.add_argument('--queue_size', type=int, default=QUEUE_SIZE, help='Samples buffered ahead of the writer')
+    parser.add_argument('--shm', action='store_true', help='Also publish every sample to shared-memory rings (see shm_ring.py)')
+    parser.add_argument('--fsync_interval', type=float, default=FSYNC_INTERVAL, help='Seconds between fsyncs of the output CSVs')
+    args = parser.parse_args()
+
+    exit_on_sigterm()
+    sensors = build_sensors(args)
+    outputs = {sensor.name: os.path.join(args.output_dir, f"{sensor.name}.csv") for sensor in sensors}
+    engine = SensorEngine(args.pid, sensors, outputs, args.queue_size, args.fsync_interval, args.shm)
+    asyncio.run(engine.run())
+    print(f"sensor_engine: run summary\n{engine.report()}")
@@ -0,0 +1,195 @@
+import argparse
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+RING_PREFIX = "power_util_"
+CAPACITY = 4096        # samples kept per sensor
+NAME_BYTES = 64        # per field name in the layout block
+MAGIC = 0x50574552494E4731
+VERSION = 1
+# header words: magic, version, capacity, n_fields, seq, head
+HEADER_WORDS = 8
+SEQ, HEAD = 4, 5
+
+
+def ring_name(sensor):
+    return RING_PREFIX + sensor
+
+
+class ShmRing:
+    """Fixed-layout ring of float64 samples in POSIX shared memory.
+
+    Layout: an int64 header, the field names, then struct-of-arrays data:
+    one time column and one column per field, each 2 * capacity long.
+    Every sample is written at slot and slot + capacity, so the latest n
+    samples are always one contiguous slice and latest() returns plain
+    NumPy views without copying.
+
+    There is a single writer. publish() bumps seq to odd, writes the slot,
+    advances head and bumps seq back to even (a seqlock); last() and
+    snapshot() retry until they read under an unchanged even seq. Views
+    from latest() stay valid until the writer wraps over them, which
+    valid() checks afterwards. Times are time.monotonic() of the writer,
+    which is the same clock in every process on the machine.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if self.header[0] != MAGIC or self.header[1] != VERSION:
+            raise RuntimeError(f"{shm.name} is not a power_util ring (or a different layout version)")
+        self.capacity = int(self.header[2])
+        n_fields = int(self.header[3])
+        offset = HEADER_WORDS * 8
+        names = np.ndarray((n_fields,), dtype=f"S{NAME_BYTES}", buffer=shm.buf, offset=offset)
+        self.fields = [name.decode() for name in names]
+        offset += n_fields * NAME_BYTES
+        offset += -offset % 8
+        self.data = np.ndarray((n_fields + 1, 2 * self.capacity), dtype=np.float64, buffer=shm.buf, offset=offset)
+        self.times = self.data[0]
+        self.columns = {field: self.data[i + 1] for i, field in enumerate(self.fields)}
+
+    @staticmethod
+    def size(n_fields, capacity):
+        names = n_fields * NAME_BYTES
+        return HEADER_WORDS * 8 + names + (-names % 8) + (n_fields + 1) * 2 * capacity * 8
+
+    @classmethod
+    def create(cls, name, fields, capacity=CAPACITY):
+        """Create (or replace a stale) ring; the creating process is its only writer."""
+        size = cls.size(len(fields), capacity)
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a collector that was killed
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        # created under sudo: hand the segment to the invoking user so the
+        # dashboard and governor can attach without root
+        if "SUDO_UID" in os.environ:
+            os.fchown(shm._fd, int(os.environ["SUDO_UID"]), int(os.environ["SUDO_GID"]))
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[1:4] = [VERSION, capacity, len(fields)]
+        names = np.ndarray((len(fields),), dtype=f"S{NAME_BYTES}", buffer=shm.buf, offset=HEADER_WORDS * 8)
+        names[:] = [field.encode()[:NAME_BYTES] for field in fields]
+        header[0] = MAGIC  # written last: readers never see a half-initialised layout
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Open an existing ring read-only in spirit; the writer keeps ownership."""
+        shm = shared_memory.SharedMemory(name)
+        # Python < 3.13 would unlink the segment when this reader exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    def publish(self, t, values):
+        header = self.header
+        head = int(header[HEAD])
+        slot = head % self.capacity
+        header[SEQ] += 1
+        column = self.data[:, slot]
+        column[0] = t
+        column[1:] = values
+        self.data[:, slot + self.capacity] = column
+        header[HEAD] = head + 1
+        header[SEQ] += 1
+
+    def head(self):
+        """Number of samples published so far."""
+        return int(self.header[HEAD])
+
+    def latest(self, n):
+        """(head, times, {field: values}) views of the latest n samples, oldest first."""
+        head = self.head()
+        n = min(n, head, self.capacity)
+        end = head % self.capacity + self.capacity
+        return head, self.times[end - n:end], {field: col[end - n:end] for field, col in self.columns.items()}
+
+    def valid(self, head, n):
+        """True if the n samples returned by latest() at `head` have not been overwritten since."""
+        return self.head() + 1 - head + n <= self.capacity
+
+    def last(self):
+        """(t, {field: value}) of the newest sample, read consistently; None if empty."""
+        while True:
+            seq = int(self.header[SEQ])
+            if seq & 1:
+                continue
+            head = int(self.header[HEAD])
+            if head == 0:
+                return None
+            column = self.data[:, (head - 1) % self.capacity].copy()
+            if int(self.header[SEQ]) == seq:
+                return column[0], dict(zip(self.fields, column[1:].tolist()))
+
+    def snapshot(self, n):
+        """Copy of the latest n samples, retried until consistent: (times, {field: values})."""
+        while True:
+            head, times, columns = self.latest(n)
+            times = times.copy()
+            columns = {field: values.copy() for field, values in columns.items()}
+            if self.valid(head, len(times)):
+                return times, columns
+
+    def close(self):
+        self.times = self.columns = self.data = self.header = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingTee:
+    """CSV writer stand-in that also publishes each row's numeric columns to a ring.
+
+    Rows start with 'Time (s)' relative to t0 (time.monotonic); the ring
+    gets the absolute monotonic time so live readers can compare it with
+    their own clock.
+    """
+
+    def __init__(self, writer, ring, t0):
+        self.writer = writer
+        self.ring = ring
+        self.t0 = t0
+
+    @property
+    def rows(self):
+        return self.writer.rows
+
+    def writerow(self, row):
+        self.ring.publish(self.t0 + row[0], row[1:])
+        self.writer.writerow(row)
+
+    def close(self):
+        self.writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print the live samples a collector publishes to shared memory.')
+    parser.add_argument('--sensor', type=str, default='cpu_power', help='Sensor ring to read, e.g. cpu_power, gpu_metrics')
+    parser.add_argument('--fields', type=str, default=None, help='Comma-separated columns to show (default: all)')
+    parser.add_argument('--samples', type=int, default=10, help='Samples averaged per line')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between lines')
+    args = parser.parse_args()
+
+    ring = ShmRing.attach(ring_name(args.sensor))
+    fields = args.fields.split(",") if args.fields else ring.fields
+    try:
+        while True:
+            times, columns = ring.snapshot(args.samples)
+            if len(times):
+                age_ms = (time.monotonic() - times[-1]) * 1000
+                means = ", ".join(f"{field} {columns[field].mean():.2f}" for field in fields)
+                print(f"[{ring.head()} samples, newest {age_ms:.1f} ms old] {means}")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
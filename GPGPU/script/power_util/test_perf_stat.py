@@ -0,0 +1,48 @@
+from perf_stat import MultiplexSummary, iter_perf_intervals, parse_perf_line
+
+
+def test_plain_line():
+    sample = parse_perf_line("1.001,S0,32,1234567,,instructions,16000000000,100.00,,")
+    assert sample.socket == 0
+    assert sample.value == 1234567
+    assert sample.run_time == 16000000000
+    assert sample.pct_running == 100.0
+    assert sample.cgroup is None
+
+
+def test_cgroup_session_system_wide_line():
+    # -G session: system-wide events still get the (empty) cgroup column
+    sample = parse_perf_line("1.001,S0,32,1234567,,instructions,,16000000000,100.00,,", cgroups=True)
+    assert sample.event == "instructions"
+    assert sample.cgroup is None
+    assert sample.run_time == 16000000000
+    assert sample.pct_running == 100.0
+
+
+def test_cgroup_session_scoped_line():
+    sample = parse_perf_line("1.001,S0,32,4567,,instructions,bench,8000000000,50.00,,", cgroups=True)
+    assert sample.cgroup == "bench"
+    assert sample.run_time == 8000000000
+    assert sample.pct_running == 50.0
+
+
+def test_not_counted_and_garbage_values():
+    assert parse_perf_line("1.0,CPU0,<not counted>,,cycles,0,0.00,,").value is None
+    assert parse_perf_line("1.0,CPU0,12ab,,cycles,100,50.00,,").value is None
+    assert parse_perf_line("# started on Mon") is None
+
+
+def test_multiplex_summary_keeps_cgroup_and_system_apart():
+    lines = ["1.0,S0,32,100,,instructions,bench,10,50.00,,",
+             "1.0,S0,32,200,,instructions,,10,100.00,,",
+             "2.0,S0,32,100,,instructions,bench,10,25.00,,",
+             "2.0,S0,32,200,,instructions,,10,100.00,,"]
+    summary = MultiplexSummary()
+    intervals = list(iter_perf_intervals(lines, cgroups=True))
+    assert [ts for ts, _ in intervals] == [1.0, 2.0]
+    for _, samples in intervals:
+        for sample in samples:
+            summary.add(sample)
+    assert summary.stats[("instructions", "bench")][1:] == [2, 0, 75.0, 25.0]
+    assert summary.stats[("instructions", None)][1:] == [0, 0, 200.0, 100.0]
+    assert "instructions [bench]" in summary.report()
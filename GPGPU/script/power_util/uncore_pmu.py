@@ -0,0 +1,125 @@
+import os
+import re
+
+from perf_stat import cas_to_mb
+
+PMU_ROOT = "/sys/bus/event_source/devices"
+CPU_ROOT = "/sys/devices/system/cpu"
+UNCORE_KINDS = ("imc", "cha", "upi")
+
+# UNC_UPI_TxL_FLITS.ALL_DATA (same encoding on SKX/ICX/SPR); 9 data flits carry one 64 B line
+UPI_TX_DATA = "event=0x2,umask=0xf"
+UPI_BYTES_PER_FLIT = 64 / 9
+
+
+def parse_cpu_list(text):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def pmu_sort_key(name):
+    m = re.search(r"_(\d+)$", name)
+    return (name.rsplit("_", 1)[0] if m else name, int(m.group(1)) if m else -1)
+
+
+class UncorePmus:
+    """Uncore IMC/CHA/UPI PMUs of this machine, found once at startup.
+
+    Every uncore PMU's cpumask lists one CPU per socket, and perf -A reports
+    each uncore event once per cpumask CPU, so mapping those CPUs to their
+    package id is what splits the counts per socket.
+    """
+
+    def __init__(self, root=PMU_ROOT, cpu_root=CPU_ROOT):
+        self.pmus = {kind: [] for kind in UNCORE_KINDS}
+        self.cpu_socket = {}
+        self.sockets = []
+        if not os.path.isdir(root):
+            return
+        for name in sorted(os.listdir(root), key=pmu_sort_key):
+            # uncore_imc_free_running_* and friends do not match: they have no cas_count events
+            m = re.match(r"^uncore_(imc|cha|upi)(_\d+)?$", name)
+            if not m:
+                continue
+            kind = m.group(1)
+            if kind == "imc" and not os.path.exists(os.path.join(root, name, "events", "cas_count_read")):
+                continue
+            self.pmus[kind].append(name)
+            try:
+                with open(os.path.join(root, name, "cpumask")) as f:
+                    cpus = parse_cpu_list(f.read())
+            except OSError:
+                continue
+            for cpu in cpus:
+                if cpu not in self.cpu_socket:
+                    self.cpu_socket[cpu] = self.read_socket(cpu_root, cpu)
+        self.sockets = sorted(set(self.cpu_socket.values()))
+
+    @staticmethod
+    def read_socket(cpu_root, cpu):
+        try:
+            with open(os.path.join(cpu_root, f"cpu{cpu}", "topology", "physical_package_id")) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def socket_of(self, cpu):
+        """Package id of an uncore cpumask CPU; the first socket if it is unknown."""
+        return self.cpu_socket.get(cpu, self.sockets[0] if self.sockets else 0)
+
+    def events(self):
+        events = []
+        for pmu in self.pmus["imc"]:
+            events += [f"{pmu}/cas_count_read/", f"{pmu}/cas_count_write/"]
+        for pmu in self.pmus["upi"]:
+            # name= keeps the comma in the raw encoding out of perf's -x, output
+            events.append(f"{pmu}/{UPI_TX_DATA},name=upi_tx_data/")
+        return events
+
+    def perf_event_list(self):
+        """The events() set as (pmu, name, raw spec or None) for perf_event.PerfEventCounters."""
+        events = []
+        for pmu in self.pmus["imc"]:
+            events += [(pmu, "cas_count_read", None), (pmu, "cas_count_write", None)]
+        for pmu in self.pmus["upi"]:
+            events.append((pmu, "upi_tx_data", UPI_TX_DATA))
+        return events
+
+    def summary(self):
+        counts = ", ".join(f"{len(self.pmus[kind])} {kind.upper()}" for kind in UNCORE_KINDS)
+        return f"{counts} PMUs on {len(self.sockets)} socket(s)"
+
+
+class SocketTraffic:
+    """MB read and written at the IMCs and sent over UPI, per socket, for one interval."""
+
+    def __init__(self, uncore):
+        self.read_mb = dict.fromkeys(uncore.sockets, 0.0)
+        self.write_mb = dict.fromkeys(uncore.sockets, 0.0)
+        self.upi_mb = dict.fromkeys(uncore.sockets, 0.0)
+
+    @classmethod
+    def from_counters(cls, uncore, counters):
+        """Traffic of the last PerfEventCounters.read(), split by the cpumask CPU of each count."""
+        traffic = cls(uncore)
+        for (name, cpu), value in counters.per_cpu.items():
+            traffic.add(uncore.socket_of(cpu), name, value, counters.units[name])
+        return traffic
+
+    def add(self, socket, name, value, unit):
+        """Add one uncore count; name is the perf event (or alias) it came from."""
+        if "upi_tx_data" in name:
+            self.upi_mb[socket] = self.upi_mb.get(socket, 0.0) + value * UPI_BYTES_PER_FLIT / 1_000_000
+        elif "cas_count_read" in name:
+            self.read_mb[socket] = self.read_mb.get(socket, 0.0) + cas_to_mb(value, unit)
+        elif "cas_count_write" in name:
+            self.write_mb[socket] = self.write_mb.get(socket, 0.0) + cas_to_mb(value, unit)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Intel perfmon event database lookup, importable and non-interactive.
+
+pmu-query.py is the command-line front end; other tools can import this
+module to turn perfmon event names into perf raw event strings for the
+running CPU.
+"""
+import io
+import urllib.request
+import json
+import csv
+import os
+# subprocess is used as multiplatform approach, usage is verified (20-07-2022)
+import subprocess  # nosec
+import sys
+import platform
+import getopt
+import re
+import shutil
+
+MAPFILE_URL = "https://raw.githubusercontent.com/intel/perfmon/main/mapfile.csv"
+PERFMON_URL = "https://raw.githubusercontent.com/intel/perfmon/main"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pmu-query")
+
+
+def fetch(path, cache_dir=CACHE_DIR):
+    """Download a perfmon file (mapfile or event JSON), keeping a copy in cache_dir."""
+    cached = os.path.join(cache_dir, path.strip("/").replace("/", "_")) if cache_dir else None
+    if cached and os.path.exists(cached):
+        with open(cached) as f:
+            return f.read()
+    url = MAPFILE_URL if path == "mapfile.csv" else PERFMON_URL + path
+    # vefified that link to mapfile.csv and links created on base of it are safe and correct (20-07-2022)
+    data = urllib.request.urlopen(url).read().decode("utf-8")  # nosec
+    if cached:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cached, "w") as f:
+            f.write(data)
+    return data
+
+
+def cpu_signature():
+    """Vendor-family-model-stepping string the mapfile regexes are matched against."""
+    if platform.system() == "Linux":
+        info = {}
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if not line.strip():
+                    break
+                key, _, value = line.partition(":")
+                info[key.strip()] = value.strip()
+        return "%s-%s-%X-%s" % (info.get("vendor_id"), info.get("cpu family"),
+                                int(info.get("model", "0")), info.get("stepping"))
+    return pcm_core_signature()
+
+
+def pcm_core_signature():
+    if platform.system() == "CYGWIN_NT-6.1":
+        p = subprocess.Popen(["./pcm-core.exe -c"], stdout=subprocess.PIPE, shell=True)
+    elif platform.system() == "Windows":
+        p = subprocess.Popen(["pcm-core.exe", "-c"], stdout=subprocess.PIPE, shell=True)
+    elif platform.system() == "Linux":
+        pcm_core = shutil.which("pcm-core")
+        if not pcm_core:
+            raise RuntimeError("Could not find pcm-core executable!")
+        p = subprocess.Popen([pcm_core, "-c"], stdout=subprocess.PIPE, shell=True)
+    else:
+        p = subprocess.Popen(["../build/bin/pcm-core -c"], stdout=subprocess.PIPE, shell=True)
+    (output, err) = p.communicate()
+    p.wait()
+    return output.decode("utf-8")
+
+
+def event_file_paths(signature, cache_dir=CACHE_DIR):
+    """(core path, offcore path) of the perfmon JSON files for a CPU signature."""
+    core_path = ""
+    offcore_path = ""
+    for model in csv.DictReader(io.StringIO(fetch("mapfile.csv", cache_dir)), delimiter=","):
+        if re.search(model["Family-model"], signature):
+            if model["EventType"] == "core":
+                core_path = model["Filename"]
+            elif model["EventType"] == "offcore":
+                offcore_path = model["Filename"]
+    return core_path, offcore_path
+
+
+def parse_events(data):
+    """Event list from a perfmon JSON file (old bare-list or newer {'Events': [...]} layout)."""
+    events = json.loads(data) if isinstance(data, str) else data
+    if isinstance(events, dict):
+        events = events.get("Events", [])
+    return events
+
+
+def load_events(files=None, signature=None, cache_dir=CACHE_DIR, download_dir=None):
+    """All core and offcore events for `files`, or for the CPU given by `signature` (default: this one)."""
+    events = []
+    if files:
+        for f in files:
+            with open(f) as fh:
+                events.extend(parse_events(fh.read()))
+        return events
+    signature = signature or cpu_signature()
+    core_path, offcore_path = event_file_paths(signature, cache_dir)
+    if not core_path:
+        raise RuntimeError("no core event found for %s CPU" % signature)
+    for path in (core_path, offcore_path):
+        if not path:
+            continue
+        file_events = parse_events(fetch(path, cache_dir))
+        if download_dir is not None:
+            with open(os.path.join(download_dir, path.split("/")[-1]), "w") as outfile:
+                json.dump(file_events, outfile, sort_keys=True, indent=4)
+        events.extend(file_events)
+    return events
+
+
+def query(events, name):
+    """Events whose EventName contains `name` (case-insensitive)."""
+    return [e for e in events if "EventName" in e and name.lower() in e["EventName"].lower()]
+
+
+def find_event(events, name):
+    """The event named exactly `name`, or None."""
+    for e in events:
+        if e.get("EventName", "").lower() == name.lower():
+            return e
+    return None
+
+
+def perf_encodings(event):
+    """perf raw event strings for an event, one per EventCode."""
+    def field(key):
+        return event.get(key, "0") or "0"
+
+    def is_set(key):
+        # newer perfmon files spell zero as "0x00"
+        try:
+            return int(field(key), 0) != 0
+        except ValueError:
+            return field(key) != "0"
+
+    encodings = []
+    for ev_code in event["EventCode"].split(", "):
+        encodings.append(
+            "cpu/umask=%s,event=%s,name=%s%s%s%s%s%s/"
+            % (
+                event["UMask"],
+                ev_code,
+                event["EventName"],
+                (",offcore_rsp=%s" % (field("MSRValue"))) if is_set("MSRValue") else "",
+                (",inv=%s" % (field("Invert"))) if is_set("Invert") else "",
+                (",any=%s" % (field("AnyThread"))) if is_set("AnyThread") else "",
+                (",edge=%s" % (field("EdgeDetect"))) if is_set("EdgeDetect") else "",
+                (",cmask=%s" % (field("CounterMask"))) if is_set("CounterMask") else "",
+            )
+        )
+    return encodings
+
+
+def print_matches(events, name):
+    for event in query(events, name):
+        print(event["EventName"] + ":" + event.get("BriefDescription", ""))
+        for encoding in perf_encodings(event):
+            print(encoding)
+
+
+def main(argv):
+    all_flag = False
+    download_flag = False
+    filename = None
+    names = []
+
+    try:
+        opts, args = getopt.getopt(argv, "a,f:,d,q:", ["all", "file=", "download", "query="])
+        for o, a in opts:
+            if o in ("-a", "--all"):
+                all_flag = True
+            if o in ("-f", "--file"):
+                filename = a
+            if o in ("-d", "--download"):
+                download_flag = True
+            if o in ("-q", "--query"):
+                names.append(a)
+    except getopt.GetoptError as err:
+        print("parse error: %s\n" % (str(err)))
+        sys.exit(-2)
+
+    try:
+        if filename is None:
+            events = load_events(download_dir="." if download_flag else None)
+        else:
+            for f in filename.split(","):
+                print(f)
+            events = load_events(files=filename.split(","))
+    except RuntimeError as err:
+        print("%s, program abort..." % err)
+        sys.exit(-1)
+
+    if all_flag:
+        for event in events:
+            if "EventName" in event and "BriefDescription" in event:
+                print(event["EventName"] + ":" + event["BriefDescription"])
+        sys.exit(0)
+
+    # -q NAME answers without prompting; otherwise keep the interactive loop
+    if names:
+        for name in names:
+            print_matches(events, name)
+        return
+
+    name = input("Event to query (empty enter to quit):")
+    while name:
+        print_matches(events, name)
+        name = input("Event to query (empty enter to quit):")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])